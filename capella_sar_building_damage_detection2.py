@@ -343,18 +343,19 @@ def download_s3_file(url: str):
 
         print(f"Downloading '{filename}' from {url}...")
 
-        # Send a GET request to the URL
-        response = requests.get(url)
-
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Open the file in binary write mode and save the content
-            with open(filename, 'wb') as f:
-                f.write(response.content)
-            print(f"Successfully downloaded and saved as '{filename}'.")
-        else:
-            # Print an error message if the download failed
-            print(f"Failed to download file. Status code: {response.status_code}")
+        # Send a streaming GET request so the body is never held in memory
+        with requests.get(url, stream=True) as response:
+
+            # Check if the request was successful
+            if response.status_code == 200:
+                # Write the content to disk chunk by chunk
+                with open(filename, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        f.write(chunk)
+                print(f"Successfully downloaded and saved as '{filename}'.")
+            else:
+                # Print an error message if the download failed
+                print(f"Failed to download file. Status code: {response.status_code}")
 
     except requests.exceptions.RequestException as e:
         # Handle potential network or request errors
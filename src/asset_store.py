@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import urllib.parse
+from contextlib import contextmanager
+
+import requests
+
+from utils import RAW_DIR, download_file, file_sha256
+from range_download import remote_object
+from http_session import transfer_stats
+from cog import convert_to_cog, cog_path_for
+
+logger = logging.getLogger("asset_store")
+
+# shared by every job that mounts the data volume
+ASSET_DIR = os.path.join(RAW_DIR, "assets")
+MANIFEST_PATH = os.path.join(ASSET_DIR, "manifest.json")
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive lock on path (created if missing), held until the block
+    exits. flock locks are per open file, so they exclude other threads,
+    processes and pods on the same volume alike.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def asset_lock(name):
+    """
+    Lock for producing the asset called name, so concurrent jobs build it
+    once.
+    """
+    return file_lock(os.path.join(ASSET_DIR, "locks", f"{name}.lock"))
+
+
+def load_manifest():
+    """
+    {name: entry} for every stored asset. Entries record the source url,
+    its ETag, the content's sha256 and size, the object path (relative to
+    ASSET_DIR) and when it was stored.
+    """
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)["assets"]
+
+
+def _record_asset(name, entry):
+    with file_lock(f"{MANIFEST_PATH}.lock"):
+        assets = load_manifest()
+        assets[name] = entry
+        tmp_path = f"{MANIFEST_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"assets": assets}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, MANIFEST_PATH)
+
+
+def _object_path(entry):
+    return os.path.join(ASSET_DIR, entry["path"])
+
+
+def _is_stored(entry):
+    path = _object_path(entry)
+    return os.path.exists(path) and os.path.getsize(path) == entry["size"]
+
+
+def resolve_asset(name):
+    """
+    Local path of the stored asset called name, or None.
+    """
+    entry = load_manifest().get(name)
+    if entry is None or not _is_stored(entry):
+        return None
+    return _object_path(entry)
+
+
+def _link(object_path, link_path):
+    """
+    Points link_path (e.g. the bare file name in RAW_DIR that older code
+    and GDAL tools expect) at object_path, replacing it atomically.
+    """
+    if os.path.islink(link_path) and os.readlink(link_path) == object_path:
+        return
+    if os.path.exists(link_path) and not os.path.islink(link_path):
+        # a plain download from before the store; the object replaces it
+        os.remove(link_path)
+    tmp_link = f"{link_path}.{os.getpid()}.link"
+    os.symlink(object_path, tmp_link)
+    os.replace(tmp_link, link_path)
+
+
+def put_asset(name, path, url=None, etag=None, link_dir=RAW_DIR):
+    """
+    Moves the file at path into the store under its sha256 and records it
+    as name. The object keeps its file name inside objects/<sha256>/, and a
+    link of that name is placed in link_dir. Returns the object path.
+    """
+    digest = file_sha256(path)
+    filename = os.path.basename(path)
+    object_dir = os.path.join(ASSET_DIR, "objects", digest)
+    object_path = os.path.join(object_dir, filename)
+    os.makedirs(object_dir, exist_ok=True)
+    if os.path.exists(object_path):
+        # same content already stored (another name or URL)
+        os.remove(path)
+    else:
+        os.replace(path, object_path)
+        if os.path.exists(f"{path}.sha256"):
+            os.replace(f"{path}.sha256", f"{object_path}.sha256")
+    if os.path.exists(f"{path}.sha256"):
+        os.remove(f"{path}.sha256")
+
+    entry = {
+        "url": url,
+        "etag": etag,
+        "sha256": digest,
+        "size": os.path.getsize(object_path),
+        "path": os.path.relpath(object_path, ASSET_DIR),
+        "stored": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    _record_asset(name, entry)
+    if link_dir is not None:
+        _link(object_path, os.path.join(link_dir, filename))
+    logger.info(f"Stored asset {name}: {entry['path']} ({entry['size']} bytes)")
+    return object_path
+
+
+def fetch_asset(name, url, filename=None, link_dir=RAW_DIR):
+    """
+    Local path of the asset called name, downloaded from url unless the
+    store already holds the same URL and ETag.
+
+    One job downloads while the others wait on the asset's lock and then
+    reuse its object. Downloads are staged under a per-URL directory, so
+    one interrupted in any job resumes in the next.
+    """
+    filename = filename or os.path.basename(urllib.parse.urlparse(url).path)
+    try:
+        size, etag, _ = remote_object(url)
+    except requests.RequestException as e:
+        logger.warning(f"Could not check {url} ({e}); using the stored copy")
+        size, etag = None, None
+
+    def current(entry):
+        return (
+            entry is not None
+            and entry["url"] == url
+            and (etag is None or entry["etag"] == etag)
+            and (size is None or entry["size"] == size)
+            and _is_stored(entry)
+        )
+
+    entry = load_manifest().get(name)
+    if not current(entry):
+        with asset_lock(name):
+            entry = load_manifest().get(name)
+            if not current(entry):
+                url_key = hashlib.sha1(url.encode()).hexdigest()[:16]
+                staging = os.path.join(ASSET_DIR, "staging", url_key, filename)
+                legacy = os.path.join(link_dir or RAW_DIR, filename)
+                if (
+                    os.path.isfile(legacy)
+                    and not os.path.islink(legacy)
+                    and (size is None or os.path.getsize(legacy) == size)
+                ):
+                    # a complete plain download from before the store
+                    logger.info(f"Moving {legacy} into the asset store")
+                    staging = legacy
+                else:
+                    download_file(url, staging)
+                put_asset(name, staging, url=url, etag=etag, link_dir=link_dir)
+                return _object_path(load_manifest()[name])
+
+    logger.info(f"Asset {name} already stored: {entry['path']}")
+    transfer_stats.add_reused(entry["size"])
+    object_path = _object_path(entry)
+    if link_dir is not None:
+        _link(object_path, os.path.join(link_dir, os.path.basename(object_path)))
+    return object_path
+
+
+def asset_cog(name, link_dir=RAW_DIR):
+    """
+    COG of the stored raster asset called name, written next to its link
+    in link_dir and converted once even when several jobs ask at once.
+    Rebuilt when the asset was replaced by a newer download.
+    """
+    object_path = resolve_asset(name)
+    if object_path is None:
+        raise FileNotFoundError(f"Asset {name} is not in the store")
+    link_path = os.path.join(link_dir, os.path.basename(object_path))
+    with asset_lock(f"{name}_cog"):
+        cog_path = cog_path_for(link_path)
+        stale = os.path.exists(cog_path) and (
+            os.path.getmtime(cog_path) < os.path.getmtime(object_path)
+        )
+        return convert_to_cog(link_path, overwrite=stale)
+
+
+def remove_unreferenced(dry_run=False):
+    """
+    Deletes stored objects that no manifest entry points to (superseded
+    versions of an asset). Returns the bytes freed.
+    """
+    with file_lock(f"{MANIFEST_PATH}.lock"):
+        live = {os.path.dirname(e["path"]) for e in load_manifest().values()}
+        freed = 0
+        objects_dir = os.path.join(ASSET_DIR, "objects")
+        for digest in os.listdir(objects_dir) if os.path.isdir(objects_dir) else []:
+            rel = os.path.join("objects", digest)
+            if rel in live:
+                continue
+            path = os.path.join(ASSET_DIR, rel)
+            freed += sum(
+                os.path.getsize(os.path.join(root, f))
+                for root, _, files in os.walk(path)
+                for f in files
+            )
+            if not dry_run:
+                shutil.rmtree(path)
+    return freed
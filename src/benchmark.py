@@ -0,0 +1,910 @@
+import os
+import re
+import json
+import time
+import pickle
+import shutil
+import logging
+import tempfile
+import threading
+import urllib.parse
+from http.server import (
+    BaseHTTPRequestHandler,
+    SimpleHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+
+import numpy as np
+import requests
+import shapely
+import geopandas as gpd
+import rasterio
+from rasterio.mask import mask
+
+from utils import (
+    RAW_DIR,
+    RESULTS_DIR,
+    build_valid_data_boundary,
+    footprint_ids,
+    prepare_footprints,
+    query_gdb_contained_by_polygon,
+)
+from chip_extraction import (
+    decoded_bytes,
+    iter_chips,
+    plan_read_groups,
+    spatial_order,
+    union_window,
+)
+from chip_store import open_chip_writer
+from footprint_table import FootprintTable
+from normalization import (
+    stretch_and_pad,
+    compute_scene_histogram,
+)
+from cog import COG_SUFFIX, convert_to_cog
+from spatial_index import FootprintIndex, filter_within
+from footprint_cache import load_footprints
+from range_download import download_ranged, download_stream, file_md5
+from feature_service import download_features
+from remote_raster import GDAL_REMOTE_OPTIONS, remote_path
+
+logger = logging.getLogger("benchmark")
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_chip_extraction(raster_path, gdf, sample_size=2000, random_state=42):
+    """
+    Times per-footprint rasterio.mask calls against the windowed-read
+    extractor on the same footprints and checks the chips are identical.
+    """
+    with rasterio.open(raster_path) as src:
+        if gdf.crs != src.crs:
+            gdf = gdf.to_crs(src.crs)
+        if len(gdf) > sample_size:
+            gdf = gdf.sample(sample_size, random_state=random_state)
+
+        def legacy():
+            chips = {}
+            for idx, row in gdf.iterrows():
+                try:
+                    out_image, _ = mask(src, [row.geometry], crop=True, nodata=0)
+                except ValueError:
+                    continue
+                chips[str(idx)] = out_image[0]
+            return chips
+
+        def windowed():
+            table = FootprintTable.from_geodataframe(gdf, src)
+            return {idx: chip for _, idx, _, chip in iter_chips(table, src)}
+
+        legacy_chips, legacy_s = _timed(legacy)
+        windowed_chips, windowed_s = _timed(windowed)
+
+    mismatches = sum(
+        1
+        for idx, chip in legacy_chips.items()
+        if idx not in windowed_chips or not np.array_equal(chip, windowed_chips[idx])
+    )
+    result = {
+        "footprints": len(gdf),
+        "mask_seconds": legacy_s,
+        "windowed_seconds": windowed_s,
+        "speedup": legacy_s / windowed_s if windowed_s > 0 else None,
+        "mismatched_chips": mismatches,
+    }
+    logger.info(
+        f"Chip extraction: mask {legacy_s:.2f}s vs windowed {windowed_s:.2f}s "
+        f"over {len(gdf)} footprints ({mismatches} mismatches)"
+    )
+    return result
+
+
+def benchmark_footprint_table(raster_path, gdf):
+    """
+    Compares the GeoDataFrame a split used to be passed around as with its
+    FootprintTable: conversion time, pickled size (what each worker shard
+    receives) and the time to walk every row's id, label and geometry.
+    """
+    with rasterio.open(raster_path) as src:
+        if gdf.crs != src.crs:
+            gdf = gdf.to_crs(src.crs)
+        table, convert_s = _timed(FootprintTable.from_geodataframe, gdf, src)
+
+    def walk_frame():
+        return sum(1 for idx, row in gdf.iterrows() if row.geometry is not None)
+
+    def walk_table():
+        geoms = table.geometries()
+        return sum(1 for i in range(len(table)) if geoms[i] is not None)
+
+    _, frame_s = _timed(walk_frame)
+    _, table_s = _timed(walk_table)
+    result = {
+        "footprints": len(gdf),
+        "convert_seconds": convert_s,
+        "frame_pickle_bytes": len(pickle.dumps(gdf)),
+        "table_pickle_bytes": len(pickle.dumps(table)),
+        "table_nbytes": table.nbytes,
+        "iterrows_seconds": frame_s,
+        "table_walk_seconds": table_s,
+    }
+    logger.info(
+        f"Footprint table: {result['frame_pickle_bytes']} -> "
+        f"{result['table_pickle_bytes']} pickled bytes, row walk "
+        f"{frame_s:.2f}s -> {table_s:.2f}s over {len(gdf)} footprints"
+    )
+    return result
+
+
+def benchmark_read_strategies(raster_path, gdf, max_group_shape=(1024, 1024)):
+    """
+    Compares per-footprint window reads with grouped reads of neighbouring
+    footprints (masked per footprint or from one burned label raster per
+    group), all in spatial order: seconds, number of reads and bytes of
+    blocks decoded.
+    """
+    with rasterio.open(raster_path) as src:
+        if gdf.crs != src.crs:
+            gdf = gdf.to_crs(src.crs)
+        table = FootprintTable.from_geodataframe(gdf, src)
+        table = table.take(spatial_order(table.windows, src))
+        windows = table.windows
+        groups = plan_read_groups(windows, src.block_shapes[0], max_group_shape)
+        regions = [
+            region if region is not None else tuple(windows[members[0]])
+            for region, members in groups
+        ]
+
+        result = {}
+        for name, group_reads, burn_labels, reads, region_list in (
+            ("per_footprint", False, False, len(windows), windows),
+            ("grouped", True, False, len(groups), regions),
+            ("grouped_burned_labels", True, True, len(groups), regions),
+        ):
+            with rasterio.Env(GDAL_CACHEMAX=16):
+                _, seconds = _timed(
+                    lambda: sum(
+                        1
+                        for _ in iter_chips(
+                            table, src, group_reads=group_reads, burn_labels=burn_labels
+                        )
+                    )
+                )
+            result[name] = {
+                "reads": reads,
+                "decoded_bytes": decoded_bytes(region_list, src),
+                "seconds": seconds,
+            }
+            logger.info(
+                f"Read strategy {name}: {reads} reads, "
+                f"{result[name]['decoded_bytes']} bytes decoded in {seconds:.2f}s"
+            )
+    return result
+
+
+def benchmark_chip_codecs(
+    canvases, codecs=(("png", 1), ("png", 6), ("png", 9), ("npy", None), ("zstd", 3)),
+    write_threads=4,
+):
+    """
+    Writes the same uint8 canvases with every (codec, level) through the
+    background writer and reports bytes and seconds per codec.
+    """
+    results = {}
+    for codec, level in codecs:
+        out_dir = tempfile.mkdtemp(prefix="chip_codec_")
+        try:
+            writer = open_chip_writer(
+                codec,
+                out_dir,
+                "bench",
+                compress_level=level,
+                write_threads=write_threads,
+            )
+            start = time.perf_counter()
+            for row, canvas in enumerate(canvases):
+                writer.write(row, row, 0, canvas)
+            writer.close()
+            elapsed = time.perf_counter() - start
+            name = codec if level is None else f"{codec}-{level}"
+            results[name] = {
+                "chips": len(canvases),
+                "bytes": writer.writer.bytes,
+                "seconds": elapsed,
+            }
+            logger.info(
+                f"Codec {name}: {writer.writer.bytes} bytes in {elapsed:.2f}s "
+                f"for {len(canvases)} chips"
+            )
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+    return results
+
+
+def benchmark_window_reads(original_path, cog_path, n_windows=200, size=256, seed=42):
+    """
+    Median latency of random size x size windowed reads on the original
+    raster versus its COG, each on a freshly opened dataset with a small
+    block cache so reads are not served from memory.
+    """
+    rng = np.random.default_rng(seed)
+    with rasterio.open(original_path) as src:
+        rows = rng.integers(0, max(src.height - size, 1), n_windows)
+        cols = rng.integers(0, max(src.width - size, 1), n_windows)
+
+    result = {}
+    for name, path in (("original", original_path), ("cog", cog_path)):
+        latencies = []
+        with rasterio.Env(GDAL_CACHEMAX=16):
+            with rasterio.open(path) as src:
+                for row, col in zip(rows, cols):
+                    window = rasterio.windows.Window(int(col), int(row), size, size)
+                    start = time.perf_counter()
+                    src.read(1, window=window)
+                    latencies.append(time.perf_counter() - start)
+                block_shape = src.block_shapes[0]
+        result[name] = {
+            "block_shape": list(block_shape),
+            "median_ms": float(np.median(latencies) * 1000),
+            "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        }
+        logger.info(
+            f"Window reads on {name} (blocks {block_shape}): "
+            f"median {result[name]['median_ms']:.2f} ms, "
+            f"p95 {result[name]['p95_ms']:.2f} ms"
+        )
+    return result
+
+
+def benchmark_geometry_prep(raster_path, gdf, utm_crs):
+    """
+    Times the former per-builder passes (ids, reproject to UTM, buffer,
+    reproject to the raster CRS) against prepare_footprints, and counts
+    polygon vertices before and after simplification.
+    """
+    gdf = gdf.assign(label=0)
+    with rasterio.open(raster_path) as src:
+
+        def legacy():
+            ids = footprint_ids(gdf.geometry)
+            out = gdf.to_crs(utm_crs)
+            out["geometry"] = out.buffer(5)
+            out.index = ids
+            return out[["geometry", "label"]].to_crs(src.crs)
+
+        legacy_gdf, legacy_s = _timed(legacy)
+        prepared, prepared_s = _timed(prepare_footprints, gdf, src)
+
+    def vertices(frame):
+        return int(shapely.get_num_coordinates(np.asarray(frame.geometry.values)).sum())
+
+    result = {
+        "footprints": len(gdf),
+        "legacy_seconds": legacy_s,
+        "prepare_seconds": prepared_s,
+        "legacy_vertices": vertices(legacy_gdf),
+        "prepared_vertices": vertices(prepared),
+    }
+    logger.info(
+        f"Geometry prep: {legacy_s:.2f}s -> {prepared_s:.2f}s, vertices "
+        f"{result['legacy_vertices']} -> {result['prepared_vertices']}"
+    )
+    return result
+
+
+def benchmark_spatial_filter(
+    sizes=(10_000, 100_000, 1_000_000), aoi_size=2000.0, density=1e-4,
+    queries=(1, 10, 100), seed=42
+):
+    """
+    Times fixed aoi_size (m) square AOI containment filters over synthetic
+    15 m footprints at constant density, so larger sets cover a larger
+    area (city -> statewide): a brute-force within(), filter_within (the
+    one-shot bbox prefilter) and an STRtree build plus queries, for each
+    count of AOIs queried against the same set.
+    """
+    rng = np.random.default_rng(seed)
+    result = {}
+    for n in sizes:
+        extent = np.sqrt(n / density)
+        x = rng.uniform(0, extent, n)
+        y = rng.uniform(0, extent, n)
+        geoms = shapely.box(x, y, x + 15, y + 15)
+        frame = gpd.GeoDataFrame(geometry=geoms)
+        offsets = rng.uniform(0, extent - aoi_size, (max(queries), 2))
+        aois = shapely.box(
+            offsets[:, 0], offsets[:, 1], offsets[:, 0] + aoi_size, offsets[:, 1] + aoi_size
+        )
+
+        result[n] = {}
+        for count in queries:
+            brute, brute_s = _timed(
+                lambda: [np.flatnonzero(shapely.within(geoms, aoi)) for aoi in aois[:count]]
+            )
+            filtered, filter_s = _timed(
+                lambda: [filter_within(frame, aoi).index.to_numpy() for aoi in aois[:count]]
+            )
+            # the tree is rebuilt per run, so the build counts against the queries
+            index, build_s = _timed(FootprintIndex, geoms)
+            hits, query_s = _timed(lambda: [index.within(aoi) for aoi in aois[:count]])
+            for expected, a, b in zip(brute, filtered, hits):
+                if not (np.array_equal(expected, a) and np.array_equal(expected, b)):
+                    raise AssertionError(f"Spatial filters disagree at n={n}")
+            result[n][count] = {
+                "contained": int(sum(len(h) for h in hits)),
+                "brute_force_seconds": brute_s,
+                "filter_within_seconds": filter_s,
+                "index_build_seconds": build_s,
+                "index_query_seconds": query_s,
+                "index_total_seconds": build_s + query_s,
+            }
+            logger.info(
+                f"Spatial filter n={n}, {count} AOIs: within() {brute_s * 1000:.1f} ms, "
+                f"filter_within {filter_s * 1000:.1f} ms, STRtree build + query "
+                f"{(build_s + query_s) * 1000:.1f} ms"
+            )
+    return result
+
+
+def _gdb_query_run(mode, gdb_path, layer_name, polygon_gdf):
+    """
+    Subprocess body for benchmark_gdb_query: one query, then the process's
+    peak RSS.
+    """
+    import resource
+
+    start = time.perf_counter()
+    if mode == "full_read":
+        # the query before bbox pushdown
+        gdf = gpd.read_file(gdb_path, layer=layer_name)
+        if gdf.crs != polygon_gdf.crs:
+            gdf = gdf.to_crs(polygon_gdf.crs)
+        count = int(gdf.geometry.within(polygon_gdf.geometry.iloc[0]).sum())
+    else:
+        count = len(
+            query_gdb_contained_by_polygon(
+                gdb_path, layer_name, polygon_gdf, use_arrow=mode == "bbox_arrow"
+            )
+        )
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {"contained": count, "seconds": seconds, "peak_rss_bytes": peak_rss}
+
+
+def benchmark_gdb_query(gdb_path, layer_name, polygon_gdf):
+    """
+    Peak RSS and wall time of the AOI footprint query reading the whole
+    layer versus pushing the AOI bbox down to the reader (with and without
+    Arrow), each in a fresh process.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    ctx = multiprocessing.get_context("spawn")
+    result = {}
+    for mode in ("full_read", "bbox", "bbox_arrow"):
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            result[mode] = pool.submit(
+                _gdb_query_run, mode, gdb_path, layer_name, polygon_gdf
+            ).result()
+        logger.info(
+            f"GDB query {mode}: {result[mode]['seconds']:.2f}s, peak RSS "
+            f"{result[mode]['peak_rss_bytes'] / 2**20:.0f} MiB, "
+            f"{result[mode]['contained']} contained"
+        )
+    return result
+
+
+def benchmark_footprint_cache(event, source_path, aoi=None):
+    """
+    Load time of an event's footprints from the source file versus its
+    GeoParquet cache, whole and restricted to aoi.
+    """
+    _, source_s = _timed(gpd.read_file, source_path)
+    load_footprints(event, source_path)  # builds the cache if needed
+    full, full_s = _timed(load_footprints, event, source_path)
+    result = {
+        "footprints": len(full),
+        "source_seconds": source_s,
+        "cache_seconds": full_s,
+    }
+    if aoi is not None:
+        subset, aoi_s = _timed(load_footprints, event, source_path, aoi=aoi)
+        result.update(aoi_footprints=len(subset), cache_aoi_seconds=aoi_s)
+    logger.info(
+        f"Footprints {event}: source {source_s:.2f}s, cache {full_s:.2f}s "
+        f"({len(full)} footprints)"
+    )
+    return result
+
+
+class _LocalHTTPServer(ThreadingHTTPServer):
+    """
+    Threaded test server that ignores clients hanging up mid-response
+    (GDAL's HTTP reader does so routinely).
+    """
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        import sys
+
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Static files over HTTP/1.1 with single byte-range GETs, MD5 ETags and
+    If-Range, like an S3 bucket. The server's rate (bytes/s per
+    connection) throttles each response, fail_after cuts every response
+    short after that many bytes, and bytes_sent/requests count traffic.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _file(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        server = self.server
+        with server.lock:
+            if path not in server.etags:
+                server.etags[path] = f'"{file_md5(path)}"'
+        return path, os.path.getsize(path), server.etags[path]
+
+    def _send_headers(self, status, length, etag, content_range=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        if content_range:
+            self.send_header("Content-Range", content_range)
+        self.end_headers()
+
+    def do_HEAD(self):
+        info = self._file()
+        with self.server.lock:
+            self.server.requests += 1
+        if info is not None:
+            self._send_headers(200, info[1], info[2])
+
+    def do_GET(self):
+        info = self._file()
+        if info is None:
+            return
+        path, size, etag = info
+        start, end, status, content_range = 0, size - 1, 200, None
+        match = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+        if match and self.headers.get("If-Range", etag) == etag:
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last or size - 1), size - 1)
+            else:
+                start = max(size - int(last), 0)
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status, content_range = 206, f"bytes {start}-{end}/{size}"
+        self._send_headers(status, end - start + 1, etag, content_range)
+
+        server = self.server
+        limit = end - start + 1
+        if server.fail_after is not None:
+            limit = min(limit, server.fail_after)
+        sent = 0
+        began = time.perf_counter()
+        with open(path, "rb") as f:
+            f.seek(start)
+            while sent < limit:
+                block = f.read(min(64 * 1024, limit - sent))
+                self.wfile.write(block)
+                sent += len(block)
+                if server.rate:
+                    ahead = sent / server.rate - (time.perf_counter() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        with server.lock:
+            server.bytes_sent += sent
+            server.requests += 1
+        if sent < end - start + 1:
+            self.close_connection = True
+
+
+def serve_directory(directory, rate=None):
+    """
+    Serves directory with _RangeRequestHandler on a free localhost port in
+    a background thread. Returns (server, base_url); call
+    server.shutdown() when done.
+    """
+    import functools
+
+    handler = functools.partial(_RangeRequestHandler, directory=directory)
+    server = _LocalHTTPServer(("127.0.0.1", 0), handler)
+    server.rate = rate
+    server.fail_after = None
+    server.bytes_sent = 0
+    server.requests = 0
+    server.etags = {}
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def benchmark_range_download(
+    size_mb=256, rate_mb=25, workers=(1, 4, 8), segment_mb=16, seed=42
+):
+    """
+    Throughput of a single-stream download versus concurrent range
+    segments from a local server throttled to rate_mb MB/s per connection
+    (object stores cap single connections well below link speed), and the
+    bytes a resumed download re-fetches after every connection was cut
+    halfway through its segment.
+    """
+    size = size_mb * 1024 * 1024
+    segment_size = segment_mb * 1024 * 1024
+    tmp_dir = tempfile.mkdtemp(prefix="range_bench_")
+    try:
+        serve_dir = os.path.join(tmp_dir, "serve")
+        os.makedirs(serve_dir)
+        source = os.path.join(serve_dir, "scene.tif")
+        with open(source, "wb") as f:
+            f.write(np.random.default_rng(seed).bytes(size))
+        expected_md5 = file_md5(source)
+        server, base_url = serve_directory(serve_dir, rate=rate_mb * 1e6)
+        url = f"{base_url}/scene.tif"
+        etag = f'"{expected_md5}"'
+        target = os.path.join(tmp_dir, "scene.tif")
+
+        def run(label, fn, *args, **kwargs):
+            _, seconds = _timed(fn, *args, **kwargs)
+            if file_md5(target) != expected_md5:
+                raise AssertionError(f"{label} download is corrupt")
+            os.remove(target)
+            logger.info(
+                f"Range download {label}: {seconds:.2f}s "
+                f"({size / 1e6 / seconds:.1f} MB/s)"
+            )
+            return {"seconds": seconds, "mb_per_second": size / 1e6 / seconds}
+
+        result = {"bytes": size, "rate_mb_per_connection": rate_mb}
+        result["single_stream"] = run("single stream", download_stream, url, target)
+        for n in workers:
+            result[f"ranged_{n}"] = run(
+                f"{n} workers", download_ranged, url, target, size, etag=etag,
+                workers=n, segment_size=segment_size,
+            )
+
+        # interrupted download: every response stops halfway, no retries
+        server.fail_after = segment_size // 2
+        try:
+            download_ranged(
+                url, target, size, etag=etag, workers=max(workers),
+                segment_size=segment_size, retries=0,
+            )
+        except Exception:
+            pass
+        server.fail_after = None
+        server.bytes_sent = 0
+        result["resumed"] = run(
+            "resumed", download_ranged, url, target, size, etag=etag,
+            workers=max(workers), segment_size=segment_size,
+        )
+        result["resumed"]["bytes_fetched"] = server.bytes_sent
+        logger.info(f"Resume re-fetched {server.bytes_sent / size:.0%} of the object")
+        server.shutdown()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return result
+
+
+class _FeatureServerHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for an ArcGIS FeatureServer layer /query endpoint: counts,
+    and GeoJSON pages by resultOffset/resultRecordCount capped at the
+    server's max_record_count. Every response waits latency seconds,
+    every fail_every-th request gets a 503 and every empty_every-th page
+    comes back with no features.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+        with server.lock:
+            server.requests += 1
+            fail = server.fail_every and server.requests % server.fail_every == 0
+            empty = server.empty_every and server.requests % server.empty_every == 0
+        time.sleep(server.latency)
+        if fail:
+            self._reply(503, b'{"error": "busy"}')
+            return
+        if params.get("returnCountOnly") == "true":
+            self._reply(200, json.dumps({"count": len(server.features)}).encode())
+            return
+        offset = int(params.get("resultOffset", 0))
+        count = min(int(params.get("resultRecordCount", 1000)), server.max_record_count)
+        page = {
+            "type": "FeatureCollection",
+            "features": [] if empty else server.features[offset : offset + count],
+        }
+        self._reply(200, json.dumps(page).encode())
+
+
+def serve_features(gdf, latency=0.2, max_record_count=2000, fail_every=0,
+                   empty_every=0):
+    """
+    Serves gdf's features with _FeatureServerHandler on a free localhost
+    port in a background thread. Returns (server, query_url).
+    """
+    server = _LocalHTTPServer(("127.0.0.1", 0), _FeatureServerHandler)
+    server.features = json.loads(gdf.to_json())["features"]
+    server.latency = latency
+    server.max_record_count = max_record_count
+    server.fail_every = fail_every
+    server.empty_every = empty_every
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/query"
+
+
+def _page_serially(url, page_size):
+    """
+    The original Lahaina paging loop: one blocking read_file per page.
+    """
+    gdf_list = []
+    offset = 0
+    r = requests.get(url, params={"where": "1=1", "returnCountOnly": "true", "f": "json"})
+    total = r.json()["count"]
+    while offset < total:
+        query_params = {
+            "where": "1=1",
+            "outFields": "*",
+            "f": "geojson",
+            "resultOffset": offset,
+            "resultRecordCount": page_size,
+        }
+        page_url = f"{url}?" + "&".join([f"{k}={v}" for k, v in query_params.items()])
+        page_gdf = gpd.read_file(page_url)
+        if page_gdf.empty:
+            break
+        gdf_list.append(page_gdf)
+        offset += len(page_gdf)
+    return gpd.pd.concat(gdf_list, ignore_index=True)
+
+
+def benchmark_feature_paging(n=40_000, page_size=2000, latency=0.3, seed=42):
+    """
+    Download time of n synthetic footprints from a local stand-in
+    FeatureServer with latency seconds per request: the serial paging
+    loop versus download_features, and download_features again with
+    every 7th request failing, every 11th page empty and the server
+    capping pages at half of page_size.
+    """
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-156.70, -156.66, n)
+    y = rng.uniform(20.86, 20.90, n)
+    gdf = gpd.GeoDataFrame(
+        {
+            "ClassLabel": rng.choice(["Damaged", "Undamaged"], n),
+            "Confidence": rng.uniform(0, 1, n).round(4),
+        },
+        geometry=shapely.box(x, y, x + 1e-4, y + 1e-4),
+        crs="EPSG:4326",
+    )
+
+    server, url = serve_features(gdf, latency=latency)
+    serial, serial_s = _timed(_page_serially, url, page_size)
+    concurrent, concurrent_s = _timed(download_features, url, page_size=page_size)
+    server.shutdown()
+
+    server, url = serve_features(
+        gdf, latency=latency, max_record_count=page_size // 2, fail_every=7,
+        empty_every=11,
+    )
+    flaky, flaky_s = _timed(download_features, url, page_size=page_size)
+    server.shutdown()
+
+    for label, result in (("concurrent", concurrent), ("flaky", flaky)):
+        if not (
+            result.drop(columns="geometry").equals(serial.drop(columns="geometry"))
+            and result.geometry.geom_equals_exact(serial.geometry, 0).all()
+        ):
+            raise AssertionError(f"{label} paging differs from the serial download")
+    logger.info(
+        f"Feature paging ({n} features, {latency * 1000:.0f} ms/request): serial "
+        f"{serial_s:.2f}s, concurrent {concurrent_s:.2f}s, with failures, empty "
+        f"and capped pages {flaky_s:.2f}s"
+    )
+    return {
+        "features": n,
+        "latency_seconds": latency,
+        "serial_seconds": serial_s,
+        "concurrent_seconds": concurrent_s,
+        "flaky_capped_seconds": flaky_s,
+    }
+
+
+def benchmark_remote_reads(raster_path, gdf, aoi_fraction=0.05, decimation=8):
+    """
+    Bytes and requests a local range server sees when the chips inside a
+    small AOI (aoi_fraction of the scene area, around the footprints'
+    median), the decimated valid-data boundary and the scene-normalization
+    histogram (over the AOI window, as for remote rasters) are read through /vsicurl/, with GDAL's defaults and with
+    GDAL_REMOTE_OPTIONS, against downloading the whole file. Remote chips
+    must equal local ones.
+    """
+    with rasterio.open(raster_path) as src:
+        footprints = gdf.to_crs(src.crs)
+        left, bottom, right, top = src.bounds
+        side = np.sqrt(aoi_fraction) * min(right - left, top - bottom)
+        centroids = footprints.geometry.centroid
+        cx, cy = float(np.median(centroids.x)), float(np.median(centroids.y))
+        aoi = shapely.box(cx - side / 2, cy - side / 2, cx + side / 2, cy + side / 2)
+        table = FootprintTable.from_geodataframe(filter_within(footprints, aoi), src)
+        local = {cid: chip for _, cid, _, chip in iter_chips(table, src)}
+
+    file_bytes = os.path.getsize(raster_path)
+    result = {"file_bytes": file_bytes, "aoi_fraction": aoi_fraction, "chips": len(table)}
+    tmp_dir = tempfile.mkdtemp(prefix="remote_bench_")
+    server, base_url = serve_directory(tmp_dir)
+    try:
+        runs = (
+            ("gdal_defaults", {"GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR"}),
+            ("tuned", GDAL_REMOTE_OPTIONS),
+        )
+        for label, options in runs:
+            # a separate URL per run, so GDAL's range cache starts empty
+            os.symlink(os.path.abspath(raster_path), os.path.join(tmp_dir, f"{label}.tif"))
+            server.bytes_sent = server.requests = 0
+            start = time.perf_counter()
+            with rasterio.Env(**options):
+                with rasterio.open(remote_path(f"{base_url}/{label}.tif")) as src:
+                    for _, cid, _, chip in iter_chips(table, src):
+                        if not np.array_equal(chip, local[cid]):
+                            raise AssertionError(f"Remote chip {cid} differs ({label})")
+                    chip_bytes, chip_requests = server.bytes_sent, server.requests
+                    build_valid_data_boundary(src, decimation=decimation)
+                    boundary_bytes = server.bytes_sent - chip_bytes
+            # the histogram gets its own URL too, so it cannot reuse ranges
+            # the boundary already fetched
+            hist_name = f"{label}_histogram.tif"
+            os.symlink(os.path.abspath(raster_path), os.path.join(tmp_dir, hist_name))
+            with rasterio.Env(**options):
+                with rasterio.open(remote_path(f"{base_url}/{hist_name}")) as src:
+                    compute_scene_histogram(src, region=union_window(table.windows))
+            result[label] = {
+                "seconds": time.perf_counter() - start,
+                "chip_bytes": chip_bytes,
+                "chip_requests": chip_requests,
+                "boundary_bytes": boundary_bytes,
+                "histogram_bytes": server.bytes_sent - chip_bytes - boundary_bytes,
+                "total_bytes": server.bytes_sent,
+                "requests": server.requests,
+                "fraction_of_file": server.bytes_sent / file_bytes,
+            }
+            logger.info(
+                f"Remote reads {label}: {len(table)} chips, boundary and histogram fetched "
+                f"{server.bytes_sent / 1e6:.1f} MB in {server.requests} requests "
+                f"({server.bytes_sent / file_bytes:.1%} of the "
+                f"{file_bytes / 1e6:.1f} MB file)"
+            )
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return result
+
+
+def main():
+    raster_path = os.environ.get("BENCH_RASTER")
+    footprints_path = os.environ.get(
+        "BENCH_FOOTPRINTS", os.path.join(RAW_DIR, "maxar_palisades_damage.gpkg")
+    )
+    if raster_path is None:
+        # the original download, so it can be compared with its COG
+        for f in os.listdir(RAW_DIR):
+            if (
+                "CAPELLA_C14_SS_GEO_HH_20250111163649" in f
+                and f.endswith(".tif")
+                and not f.endswith(COG_SUFFIX)
+            ):
+                raster_path = os.path.join(RAW_DIR, f)
+                break
+    if raster_path is None:
+        raise FileNotFoundError("Benchmark raster not found; set BENCH_RASTER")
+
+    gdf = gpd.read_file(footprints_path)
+    results = {
+        "geometry_prep": benchmark_geometry_prep(
+            raster_path, gdf, gdf.estimate_utm_crs()
+        )
+    }
+    gdf["label"] = 0
+    gdf = gdf.to_crs(gdf.estimate_utm_crs())
+    gdf["geometry"] = gdf.buffer(5)
+
+    results["chip_extraction"] = benchmark_chip_extraction(raster_path, gdf)
+    results["read_strategies"] = benchmark_read_strategies(raster_path, gdf)
+    results["footprint_table"] = benchmark_footprint_table(raster_path, gdf)
+    results["spatial_filter"] = benchmark_spatial_filter()
+    results["range_download"] = benchmark_range_download()
+    results["feature_paging"] = benchmark_feature_paging()
+
+    lahaina_geojson = os.path.join(RAW_DIR, "lahaina_buildings.geojson")
+    if os.path.exists(lahaina_geojson):
+        results["footprint_cache"] = benchmark_footprint_cache(
+            "lahaina", lahaina_geojson
+        )
+
+    gdb_dir = os.path.join(RAW_DIR, "co_structures")
+    gdb_paths = [
+        os.path.join(root, d)
+        for root, dirs, _ in os.walk(gdb_dir)
+        for d in dirs
+        if d.endswith(".gdb")
+    ]
+    if gdb_paths:
+        from shapely import wkt
+        from inference import CO_WKT
+
+        polygon_gdf = gpd.GeoDataFrame(
+            [1], geometry=[wkt.loads(CO_WKT)], crs="EPSG:4326"
+        )
+        results["gdb_query"] = benchmark_gdb_query(
+            gdb_paths[0], "CO_Structures", polygon_gdf
+        )
+
+    with rasterio.open(raster_path) as src:
+        sample = gdf.to_crs(src.crs).sample(min(500, len(gdf)), random_state=42)
+        chips = [
+            chip
+            for _, _, _, chip in iter_chips(
+                FootprintTable.from_geodataframe(sample, src), src
+            )
+            if chip.shape[0] <= 224 and chip.shape[1] <= 224
+        ]
+    results["chip_codecs"] = benchmark_chip_codecs(stretch_and_pad(chips, (224, 224)))
+
+    results["remote_reads"] = benchmark_remote_reads(raster_path, gdf)
+
+    if not raster_path.endswith(COG_SUFFIX):
+        results["window_reads"] = benchmark_window_reads(
+            raster_path, convert_to_cog(raster_path)
+        )
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_path = os.path.join(RESULTS_DIR, "benchmarks.json")
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Saved benchmark results to: {results_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,560 @@
+import os
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+import shapely
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask, rasterize
+from rasterio.mask import mask
+from rasterio.windows import Window
+
+logger = logging.getLogger("chip_extraction")
+
+
+def is_rectilinear(transform):
+    """
+    True when the raster transform has no rotation/shear terms, so a
+    geometry's pixel-space bounds follow directly from its map bounds.
+    """
+    return transform.b == 0 and transform.d == 0
+
+
+def footprint_windows(geoms, src):
+    """
+    Computes the crop window of every footprint from its bounds.
+
+    Matches rasterio.features.geometry_window (floor of offsets, ceiling
+    of extents, clipped to the raster) for north-up rasters, but in one
+    vectorized pass instead of walking each polygon's coordinates.
+    Returns an (N, 4) int64 array of (row_off, col_off, height, width);
+    footprints that miss the raster get a zero-sized window.
+    """
+    if not is_rectilinear(src.transform):
+        raise ValueError("footprint_windows requires a north-up raster")
+
+    inv = ~src.transform
+    bounds = shapely.bounds(np.asarray(geoms, dtype=object))
+    minx, miny, maxx, maxy = bounds.T
+
+    # apply the inverse affine the same way rasterio does per coordinate
+    cols = np.stack(
+        [inv.a * x + inv.b * y + inv.c for x, y in ((minx, miny), (maxx, maxy))]
+    )
+    rows = np.stack(
+        [inv.d * x + inv.e * y + inv.f for x, y in ((minx, miny), (maxx, maxy))]
+    )
+
+    col_start = np.floor(cols.min(axis=0))
+    col_stop = np.ceil(cols.max(axis=0))
+    row_start = np.floor(rows.min(axis=0))
+    row_stop = np.ceil(rows.max(axis=0))
+
+    # intersection with the raster window
+    col_start = np.clip(col_start, 0, src.width)
+    col_stop = np.clip(col_stop, 0, src.width)
+    row_start = np.clip(row_start, 0, src.height)
+    row_stop = np.clip(row_stop, 0, src.height)
+
+    windows = np.empty((len(bounds), 4), dtype=np.int64)
+    windows[:, 0] = row_start
+    windows[:, 1] = col_start
+    windows[:, 2] = np.maximum(row_stop - row_start, 0)
+    windows[:, 3] = np.maximum(col_stop - col_start, 0)
+    windows[np.isnan(bounds).any(axis=1)] = 0
+    return windows
+
+
+def hilbert_index(x, y, order):
+    """
+    Vectorized distance along a Hilbert curve of side 2**order for
+    integer grid coordinates x, y.
+    """
+    x = np.asarray(x, dtype=np.int64).copy()
+    y = np.asarray(y, dtype=np.int64).copy()
+    n = 1 << order
+    d = np.zeros_like(x)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+
+        # rotate the quadrant so the sub-curve is traversed in the right order
+        flip = ~ry & rx
+        x[flip] = n - 1 - x[flip]
+        y[flip] = n - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap].copy()
+        s >>= 1
+    return d
+
+
+def spatial_order(windows, src):
+    """
+    Returns the permutation that visits footprint windows along a Hilbert
+    curve over the raster's block grid, then row-major inside a block, so
+    consecutive reads hit blocks that are still in the GDAL cache.
+    """
+    block_h, block_w = src.block_shapes[0]
+    center_rows = windows[:, 0] + windows[:, 2] // 2
+    center_cols = windows[:, 1] + windows[:, 3] // 2
+    block_rows = center_rows // block_h
+    block_cols = center_cols // block_w
+
+    n_blocks = max(-(-src.height // block_h), -(-src.width // block_w), 1)
+    order = max(int(np.ceil(np.log2(n_blocks))), 1)
+    curve = hilbert_index(block_cols, block_rows, order)
+    return np.lexsort((center_cols, center_rows, curve))
+
+
+def _gdal_cache_bytes():
+    """
+    Size of the GDAL raster block cache (GDAL_CACHEMAX, default 5% of RAM).
+    """
+    value = rasterio.env.get_gdal_config("GDAL_CACHEMAX")
+    physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    if value is None:
+        return int(physical * 0.05)
+    value = str(value).strip()
+    if value.endswith("%"):
+        return int(physical * float(value[:-1]) / 100)
+    value = int(value)
+    # GDAL treats small values as megabytes
+    return value * 1024 * 1024 if value < 100000 else value
+
+
+def block_cache_hit_rate(windows, src, cache_bytes=None):
+    """
+    Simulates an LRU block cache over the reads of windows, in the order
+    given, and returns the fraction of block requests served from cache.
+    """
+    block_h, block_w = src.block_shapes[0]
+    block_bytes = block_h * block_w * np.dtype(src.dtypes[0]).itemsize
+    if cache_bytes is None:
+        cache_bytes = _gdal_cache_bytes()
+    capacity = max(int(cache_bytes // block_bytes), 1)
+
+    cache = OrderedDict()
+    hits = requests = 0
+    for row_off, col_off, height, width in windows:
+        if height == 0 or width == 0:
+            continue
+        for block_row in range(row_off // block_h, (row_off + height - 1) // block_h + 1):
+            for block_col in range(
+                col_off // block_w, (col_off + width - 1) // block_w + 1
+            ):
+                key = (block_row, block_col)
+                requests += 1
+                if key in cache:
+                    hits += 1
+                    cache.move_to_end(key)
+                else:
+                    cache[key] = None
+                    if len(cache) > capacity:
+                        cache.popitem(last=False)
+    return hits / requests if requests else 0.0
+
+
+def union_window(windows):
+    """
+    Smallest (row_off, col_off, height, width) covering every non-empty
+    window, or None when there are none.
+    """
+    windows = windows[(windows[:, 2] > 0) & (windows[:, 3] > 0)]
+    if len(windows) == 0:
+        return None
+    row_start = int(windows[:, 0].min())
+    col_start = int(windows[:, 1].min())
+    row_stop = int((windows[:, 0] + windows[:, 2]).max())
+    col_stop = int((windows[:, 1] + windows[:, 3]).max())
+    return row_start, col_start, row_stop - row_start, col_stop - col_start
+
+
+class ArrayWindowSource:
+    """
+    A decoded region of band 1, with masked pixels already set to 0, that
+    chips are sliced from as zero-copy views instead of being read again.
+    """
+
+    def __init__(self, array, row_off, col_off):
+        self.array = array
+        self.row_off = row_off
+        self.col_off = col_off
+
+    def view(self, row_off, col_off, height, width):
+        """
+        The window as a view into the region, or None if it is not covered.
+        """
+        r = row_off - self.row_off
+        c = col_off - self.col_off
+        rows, cols = self.array.shape
+        if r < 0 or c < 0 or r + height > rows or c + width > cols:
+            return None
+        return self.array[r : r + height, c : c + width]
+
+
+def read_region(src, region, out, strip_rows=1024):
+    """
+    Reads region (row_off, col_off, height, width) of band 1 into out with
+    masked pixels set to 0, a strip at a time so no second full-size copy
+    is made.
+    """
+    row_off, col_off, height, width = region
+    for start in range(0, height, strip_rows):
+        rows = min(strip_rows, height - start)
+        win = Window(col_off, row_off + start, width, rows)
+        out[start : start + rows] = src.read(1, window=win, masked=True).filled(0)
+    return out
+
+
+def create_shared_region(src, region):
+    """
+    Decodes region into a new multiprocessing.shared_memory block.
+    Returns (shm, spec); workers pass spec to attach_shared_region. The
+    caller closes and unlinks shm when the workers are done.
+    """
+    from multiprocessing import shared_memory
+
+    dtype = np.dtype(src.dtypes[0])
+    shape = (int(region[2]), int(region[3]))
+    nbytes = max(shape[0] * shape[1] * dtype.itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    try:
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        read_region(src, region, array)
+        del array
+    except BaseException:
+        # nobody else holds the name yet, so free the segment here
+        shm.close()
+        shm.unlink()
+        raise
+    spec = {
+        "name": shm.name,
+        "shape": shape,
+        "dtype": dtype.str,
+        "row_off": int(region[0]),
+        "col_off": int(region[1]),
+    }
+    return shm, spec
+
+
+def attach_shared_region(spec):
+    """
+    Attaches to a region made by create_shared_region. Returns (shm,
+    ArrayWindowSource); close shm (do not unlink) when finished.
+    """
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=spec["name"])
+    array = np.ndarray(spec["shape"], dtype=np.dtype(spec["dtype"]), buffer=shm.buf)
+    return shm, ArrayWindowSource(array, spec["row_off"], spec["col_off"])
+
+
+def decimated_shape(height, width, max_shape):
+    """
+    Largest (height, width) with the window's aspect ratio that fits in
+    max_shape, or None when the window already fits.
+    """
+    if height <= max_shape[0] and width <= max_shape[1]:
+        return None
+    scale = min(max_shape[0] / height, max_shape[1] / width)
+    return (
+        min(max(int(height * scale), 1), max_shape[0]),
+        min(max(int(width * scale), 1), max_shape[1]),
+    )
+
+
+def read_chip(
+    src,
+    geom,
+    window,
+    nodata=0,
+    max_shape=None,
+    resampling=Resampling.average,
+    source=None,
+):
+    """
+    Reads a single footprint chip with a windowed read and masks the
+    polygon locally.
+
+    Produces the same array as
+    rasterio.mask.mask(src, [geom], crop=True, nodata=nodata)[0][0].
+    When max_shape is given and the window is larger, the window is read
+    with a reduced out_shape instead, so GDAL serves it from the best
+    overview and the chip comes back at (at most) max_shape.
+    source: optional ArrayWindowSource (filled with 0, so nodata must be
+    0) to slice full-resolution windows from instead of reading src.
+    """
+    row_off, col_off, height, width = (int(v) for v in window)
+    if height == 0 or width == 0:
+        raise ValueError("Input shapes do not overlap raster.")
+
+    win = Window(col_off, row_off, width, height)
+    transform = src.window_transform(win)
+    out_shape = decimated_shape(height, width, max_shape) if max_shape else None
+    cached = None
+    if out_shape is None and source is not None:
+        cached = source.view(row_off, col_off, height, width)
+    if cached is not None:
+        shape_mask = geometry_mask(
+            [geom], transform=transform, out_shape=(height, width)
+        )
+        return np.where(shape_mask, cached.dtype.type(0), cached)
+    if out_shape is None:
+        data = src.read(1, window=win, masked=True)
+        out_shape = (height, width)
+    else:
+        data = src.read(
+            1, window=win, out_shape=out_shape, resampling=resampling, masked=True
+        )
+        transform = transform * Affine.scale(
+            width / out_shape[1], height / out_shape[0]
+        )
+
+    shape_mask = geometry_mask([geom], transform=transform, out_shape=out_shape)
+    return np.where(data.mask | shape_mask, data.dtype.type(nodata), data.data)
+
+
+def _blocks_touched(row, col, height, width, block_shape):
+    if height == 0 or width == 0:
+        return 0
+    block_h, block_w = block_shape
+    rows = (row + height - 1) // block_h - row // block_h + 1
+    cols = (col + width - 1) // block_w - col // block_w + 1
+    return int(rows * cols)
+
+
+def plan_read_groups(
+    windows, block_shape, max_group_shape=(1024, 1024), max_shape=None
+):
+    """
+    Greedily packs consecutive footprint windows (input should already be
+    spatially ordered) into shared read regions no larger than
+    max_group_shape.
+
+    A window only joins the current group if the grown region touches no
+    more raster blocks than reading it separately would, so grouping never
+    decodes more than per-footprint reads.
+
+    Returns a list of (region, positions) in input order; region is None
+    for footprints read on their own (single members, empty windows and
+    oversized windows that get a decimated read).
+    """
+    max_h, max_w = max_group_shape
+    groups = []
+    bounds = None
+    members = []
+    cost = 0
+
+    def close():
+        if not members:
+            return
+        if len(members) == 1:
+            groups.append((None, list(members)))
+        else:
+            r0, c0, r1, c1 = bounds
+            groups.append(((r0, c0, r1 - r0, c1 - c0), list(members)))
+
+    for pos, (row, col, height, width) in enumerate(windows):
+        solo = (
+            height == 0
+            or width == 0
+            or height > max_h
+            or width > max_w
+            or (max_shape is not None and decimated_shape(height, width, max_shape))
+        )
+        if solo:
+            close()
+            bounds, members = None, []
+            groups.append((None, [pos]))
+            continue
+
+        own_cost = _blocks_touched(row, col, height, width, block_shape)
+        if bounds is not None:
+            r0 = min(bounds[0], row)
+            c0 = min(bounds[1], col)
+            r1 = max(bounds[2], row + height)
+            c1 = max(bounds[3], col + width)
+            grown = _blocks_touched(r0, c0, r1 - r0, c1 - c0, block_shape)
+            if r1 - r0 <= max_h and c1 - c0 <= max_w and grown <= cost + own_cost:
+                bounds = [r0, c0, r1, c1]
+                members.append(pos)
+                cost = grown
+                continue
+            close()
+        bounds = [row, col, row + height, col + width]
+        members = [pos]
+        cost = own_cost
+    close()
+    return groups
+
+
+class FootprintLabelRaster:
+    """
+    Masks of many footprints inside one read region, burned with a single
+    rasterize call per layer using each footprint's position as its value.
+
+    Footprints whose windows overlap go to different layers (greedy
+    colouring in input order), so every pixel of a layer belongs to at
+    most one footprint and each mask is exactly what geometry_mask would
+    give for that footprint alone.
+    """
+
+    def __init__(self, geoms, windows, positions, region, transform):
+        layer_windows = []
+        layer_shapes = []
+        self.layer_of = {}
+        for pos in positions:
+            row, col, height, width = (int(v) for v in windows[pos])
+            for layer, placed in enumerate(layer_windows):
+                if not any(
+                    row < r + h and r < row + height and col < c + w and c < col + width
+                    for r, c, h, w in placed
+                ):
+                    break
+            else:
+                layer = len(layer_windows)
+                layer_windows.append([])
+                layer_shapes.append([])
+            layer_windows[layer].append((row, col, height, width))
+            layer_shapes[layer].append((geoms[pos], pos + 1))
+            self.layer_of[pos] = layer
+
+        # each layer only covers the extent of its own footprints
+        self.layers = []
+        for placed, shapes in zip(layer_windows, layer_shapes):
+            placed = np.asarray(placed)
+            row0, col0 = placed[:, 0].min(), placed[:, 1].min()
+            row1 = (placed[:, 0] + placed[:, 2]).max()
+            col1 = (placed[:, 1] + placed[:, 3]).max()
+            layer_transform = transform * Affine.translation(
+                col0 - region[1], row0 - region[0]
+            )
+            burned = rasterize(
+                shapes,
+                out_shape=(row1 - row0, col1 - col0),
+                transform=layer_transform,
+                fill=0,
+                dtype="int32",
+            )
+            self.layers.append((row0, col0, burned))
+
+    def inside(self, pos, window):
+        """
+        Boolean mask of footprint pos over its own window.
+        """
+        row, col, height, width = (int(v) for v in window)
+        row0, col0, burned = self.layers[self.layer_of[pos]]
+        r, c = row - row0, col - col0
+        return burned[r : r + height, c : c + width] == pos + 1
+
+
+def decoded_bytes(regions, src):
+    """
+    Bytes of raster blocks GDAL has to decode to read every region once
+    (no cache reuse between regions).
+    """
+    block_shape = src.block_shapes[0]
+    block_bytes = block_shape[0] * block_shape[1] * np.dtype(src.dtypes[0]).itemsize
+    blocks = sum(
+        _blocks_touched(*(int(v) for v in region), block_shape) for region in regions
+    )
+    return blocks * block_bytes
+
+
+def iter_chips(
+    table,
+    src,
+    max_shape=None,
+    source=None,
+    group_reads=True,
+    max_group_shape=(1024, 1024),
+    burn_labels=True,
+):
+    """
+    Yields (position, chip id, label, chip) for every row of a
+    footprint_table.FootprintTable, reading each one through its
+    precomputed pixel window.
+
+    Footprints that fail to read are logged and skipped, as in the
+    per-footprint mask path this replaces. With max_shape, oversized
+    footprints are read decimated to fit (see read_chip). With source,
+    windows it covers are sliced from memory. Otherwise, with group_reads,
+    neighbouring footprints share one read of up to max_group_shape and
+    their chips are cut from it (see plan_read_groups); with burn_labels,
+    the group's masks come from one FootprintLabelRaster instead of one
+    rasterization per footprint.
+    """
+    geoms = table.geometries()
+    labels = table.labels
+    windows = table.windows
+    if windows is None:
+        logger.info("Rotated raster transform; using rasterio.mask per footprint.")
+
+    if windows is None or source is not None or not group_reads:
+        groups = [(None, range(len(table)))]
+    else:
+        groups = plan_read_groups(
+            windows, src.block_shapes[0], max_group_shape, max_shape
+        )
+        regions = [
+            region if region is not None else tuple(windows[members[0]])
+            for region, members in groups
+        ]
+        logger.info(
+            f"Grouped reads: {len(groups)} reads for {len(table)} footprints, "
+            f"{decoded_bytes(regions, src)} bytes decoded vs "
+            f"{decoded_bytes(windows, src)} bytes per footprint"
+        )
+        buffer = np.empty(max_group_shape, dtype=src.dtypes[0])
+
+    for region, members in groups:
+        group_source = source
+        label_raster = None
+        if region is not None:
+            try:
+                region_buf = buffer[: region[2], : region[3]]
+                read_region(src, region, region_buf)
+            except Exception as e:
+                logger.warning(f"Error reading window {region}: {e}")
+                continue
+            group_source = ArrayWindowSource(region_buf, region[0], region[1])
+            if burn_labels:
+                try:
+                    label_raster = FootprintLabelRaster(
+                        geoms,
+                        windows,
+                        members,
+                        region,
+                        src.window_transform(
+                            Window(region[1], region[0], region[3], region[2])
+                        ),
+                    )
+                except Exception as e:
+                    logger.warning(f"Error rasterizing labels for {region}: {e}")
+
+        for i in members:
+            idx = table.ids[i]
+            try:
+                if region is not None and label_raster is not None:
+                    view = group_source.view(*(int(v) for v in windows[i]))
+                    chip = np.where(
+                        label_raster.inside(i, windows[i]), view, view.dtype.type(0)
+                    )
+                elif windows is None:
+                    chip = mask(src, [geoms[i]], crop=True, nodata=0)[0][0]
+                else:
+                    chip = read_chip(
+                        src,
+                        geoms[i],
+                        windows[i],
+                        max_shape=max_shape,
+                        source=group_source,
+                    )
+            except Exception as e:
+                logger.warning(f"Error processing building {idx}: {e}")
+                continue
+            yield i, idx, labels[i], chip
@@ -0,0 +1,491 @@
+import io
+import os
+import glob
+import json
+import time
+import hashlib
+import queue
+import shutil
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from journal import JsonlJournal, read_jsonl
+
+logger = logging.getLogger("chip_store")
+
+CHIP_CODECS = ("png", "npy", "zstd")
+CHIP_FORMATS = CHIP_CODECS + ("array",)
+
+INDEX_COLUMNS = [
+    "row",
+    "chip_id",
+    "label",
+    "minx",
+    "miny",
+    "maxx",
+    "maxy",
+    "source_scene",
+]
+
+
+def chip_array_path(store_dir, split_name):
+    return os.path.join(store_dir, f"{split_name}.npy")
+
+
+def chip_index_path(store_dir, split_name):
+    return os.path.join(store_dir, f"{split_name}_index.csv")
+
+
+def png_export_dir(dataset_dir):
+    return os.path.join(dataset_dir, "png")
+
+
+def _drop_png_export(output_dir):
+    """
+    Removes the PNG export of a chip store that is being rewritten, so the
+    next png_layout_dir call exports the new chips.
+    """
+    png_dir = png_export_dir(output_dir)
+    if os.path.isdir(png_dir):
+        logger.info(f"Removing stale PNG export {png_dir}")
+        shutil.rmtree(png_dir)
+
+
+_CODEC_EXTENSIONS = {"png": ".png", "npy": ".npy", "zstd": ".npy.zst"}
+
+
+def encode_chip(canvas, codec="png", compress_level=None):
+    """
+    Encodes one uint8 chip: PNG at a zlib level (default 6, as Pillow),
+    raw .npy, or a zstd-compressed .npy block (default level 3).
+    """
+    buf = io.BytesIO()
+    if codec == "png":
+        from PIL import Image
+
+        level = 6 if compress_level is None else compress_level
+        Image.fromarray(canvas).save(buf, format="PNG", compress_level=level)
+    elif codec == "npy":
+        np.save(buf, canvas)
+    elif codec == "zstd":
+        import zstandard
+
+        np.save(buf, canvas)
+        level = 3 if compress_level is None else compress_level
+        return zstandard.ZstdCompressor(level=level).compress(buf.getvalue())
+    else:
+        raise ValueError(f"Unknown chip codec: {codec}")
+    return buf.getvalue()
+
+
+def read_chip_file(path):
+    """
+    Decodes a chip written by FileChipWriter with any codec.
+    """
+    if path.endswith(".npy.zst"):
+        import zstandard
+
+        with open(path, "rb") as f:
+            raw = zstandard.ZstdDecompressor().decompress(f.read())
+        return np.load(io.BytesIO(raw))
+    if path.endswith(".npy"):
+        return np.load(path)
+    from PIL import Image
+
+    return np.asarray(Image.open(path))
+
+
+class FileChipWriter:
+    """
+    Writes one file per chip as split/label/building_<id>.<ext>; with the
+    png codec this is the YOLO classification folder layout. Safe to call
+    from several writer threads.
+    """
+
+    def __init__(
+        self, output_dir, split_name, codec="png", compress_level=None, journal=None
+    ):
+        self.output_dir = output_dir
+        self.split_name = split_name
+        self.codec = codec
+        self.compress_level = compress_level
+        self.extension = _CODEC_EXTENSIONS[codec]
+        self.written = []
+        self.bytes = 0
+        self.seconds = 0.0
+        self._dirs = set()
+        self._lock = threading.Lock()
+        self.journal = journal
+
+    def write(self, row, chip_id, label, canvas, key=None):
+        start = time.perf_counter()
+        out_dir = os.path.join(self.output_dir, self.split_name, str(label))
+        if out_dir not in self._dirs:
+            os.makedirs(out_dir, exist_ok=True)
+            with self._lock:
+                self._dirs.add(out_dir)
+        data = encode_chip(canvas, self.codec, self.compress_level)
+        path = os.path.join(out_dir, f"building_{chip_id}{self.extension}")
+        with open(path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            self.bytes += len(data)
+            self.seconds += time.perf_counter() - start
+            self.written.append(row)
+        if self.journal is not None and key is not None:
+            self.journal.record(
+                chip_id, key, os.path.relpath(path, self.output_dir), len(data)
+            )
+
+    def close(self):
+        logger.info(
+            f"{self.split_name} [{self.codec}]: {len(self.written)} chips, "
+            f"{self.bytes} bytes, {self.seconds:.2f}s writing"
+        )
+
+
+class ArrayChipWriter:
+    """
+    Writes chips into their rows of a split's preallocated (N, H, W) uint8
+    .npy file, opened as a memory map.
+    """
+
+    def __init__(self, output_dir, split_name):
+        self.array = np.load(chip_array_path(output_dir, split_name), mmap_mode="r+")
+        self.written = []
+
+    def write(self, row, chip_id, label, canvas, key=None):
+        self.array[row] = canvas
+        self.written.append(row)
+
+    def close(self):
+        self.array.flush()
+        del self.array
+
+
+class AsyncChipWriter:
+    """
+    Background writer stage: chips go onto a bounded queue and a thread
+    pool drains it into the wrapped writer, overlapping encode and I/O
+    with raster reads. write() blocks only while the queue is full.
+    """
+
+    def __init__(self, writer, threads=4, queue_size=256):
+        self.writer = writer
+        self.written = writer.written
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = [
+            threading.Thread(target=self._drain, daemon=True) for _ in range(threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            row, chip_id, label, canvas, key = item
+            try:
+                self.writer.write(row, chip_id, label, canvas, key)
+            except Exception as e:
+                logger.warning(f"Error processing building {chip_id}: {e}")
+
+    def write(self, row, chip_id, label, canvas, key=None):
+        # callers reuse their canvas buffers, so queue a private copy
+        self._queue.put((row, chip_id, label, canvas.copy(), key))
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.writer.close()
+
+
+def open_chip_writer(
+    output_format,
+    output_dir,
+    split_name,
+    compress_level=None,
+    write_threads=0,
+    queue_size=256,
+    journal=None,
+):
+    """
+    Builds the chip writer for output_format ("png", "npy", "zstd" files or
+    the "array" chip store). write_threads > 0 wraps it in an
+    AsyncChipWriter; file writers record keyed chips in journal.
+    """
+    if output_format in CHIP_CODECS:
+        writer = FileChipWriter(
+            output_dir, split_name, output_format, compress_level, journal
+        )
+    elif output_format == "array":
+        writer = ArrayChipWriter(output_dir, split_name)
+    else:
+        raise ValueError(f"Unknown chip output format: {output_format}")
+    if write_threads > 0:
+        writer = AsyncChipWriter(writer, threads=write_threads, queue_size=queue_size)
+    return writer
+
+
+def create_chip_array(output_dir, split_name, capacity, target_size):
+    """
+    Preallocates the split's chip array with one row per footprint so
+    workers can write their rows independently.
+    """
+    _drop_png_export(output_dir)
+    path = chip_array_path(output_dir, split_name)
+    arr = np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.uint8, shape=(capacity,) + tuple(target_size)
+    )
+    del arr
+    return path
+
+
+def finalize_chip_store(output_dir, split_name, table, rows, source_scene):
+    """
+    Drops rows for footprints that produced no chip and writes the split
+    index (chip id, label, map bounds, source scene).
+
+    table is the split's FootprintTable in row order; rows are the rows
+    that were written.
+    """
+    _drop_png_export(output_dir)
+    rows = np.sort(np.asarray(rows, dtype=np.int64))
+    path = chip_array_path(output_dir, split_name)
+    arr = np.load(path, mmap_mode="r")
+
+    if len(rows) < arr.shape[0]:
+        tmp_path = f"{path}.tmp"
+        compact = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.uint8, shape=(len(rows),) + arr.shape[1:]
+        )
+        for start in range(0, len(rows), 4096):
+            chunk = rows[start : start + 4096]
+            compact[start : start + len(chunk)] = arr[chunk]
+        compact.flush()
+        del compact, arr
+        os.replace(tmp_path, path)
+    else:
+        del arr
+
+    bounds = table.bounds[rows]
+    index = pd.DataFrame(
+        {
+            "row": np.arange(len(rows)),
+            "chip_id": table.ids[rows],
+            "label": table.labels[rows],
+            "minx": bounds[:, 0],
+            "miny": bounds[:, 1],
+            "maxx": bounds[:, 2],
+            "maxy": bounds[:, 3],
+            "source_scene": source_scene,
+        },
+        columns=INDEX_COLUMNS,
+    )
+    index.to_csv(chip_index_path(output_dir, split_name), index=False)
+    logger.info(f"Chip store {split_name}: {len(rows)} chips -> {path}")
+
+
+def load_chip_store(store_dir, split_name):
+    """
+    Returns (chips, index): the split's memory-mapped (N, H, W) uint8 array
+    and its index DataFrame.
+    """
+    chips = np.load(chip_array_path(store_dir, split_name), mmap_mode="r")
+    index = pd.read_csv(chip_index_path(store_dir, split_name), dtype={"chip_id": str})
+    return chips, index
+
+
+def has_chip_store(store_dir):
+    return any(
+        os.path.exists(chip_index_path(store_dir, split)) for split in ("train", "val", "test")
+    )
+
+
+def export_png_layout(store_dir, output_dir):
+    """
+    Writes a chip store out as the split/label/building_<id>.png layout
+    that Ultralytics classification training expects.
+    """
+    logger.info(f"Exporting chip store {store_dir} -> {output_dir}")
+    for split_name in ("train", "val", "test"):
+        if not os.path.exists(chip_index_path(store_dir, split_name)):
+            continue
+        chips, index = load_chip_store(store_dir, split_name)
+        writer = FileChipWriter(output_dir, split_name)
+        for row, chip_id, label in zip(index["row"], index["chip_id"], index["label"]):
+            writer.write(row, chip_id, label, chips[row])
+        writer.close()
+    return output_dir
+
+
+def _file_chips(dataset_dir):
+    """
+    (split, label, chip_id, path) of every .npy/.npy.zst chip file in
+    dataset_dir's split/label folders.
+    """
+    for split_name in ("train", "val", "test"):
+        split_dir = os.path.join(dataset_dir, split_name)
+        if not os.path.isdir(split_dir):
+            continue
+        for label in sorted(os.listdir(split_dir)):
+            label_dir = os.path.join(split_dir, label)
+            if not os.path.isdir(label_dir):
+                continue
+            for name in sorted(os.listdir(label_dir)):
+                for extension in (".npy.zst", ".npy"):
+                    if name.startswith("building_") and name.endswith(extension):
+                        chip_id = name[len("building_") : -len(extension)]
+                        yield split_name, label, chip_id, os.path.join(label_dir, name)
+                        break
+
+
+def export_file_chips_png(dataset_dir, output_dir):
+    """
+    Writes the npy/zstd chip files of dataset_dir as PNGs in the same
+    layout under output_dir. PNGs newer than their chip are kept and PNGs
+    whose chip is gone are removed, so reruns only convert what changed.
+    """
+    logger.info(f"Exporting chip files {dataset_dir} -> {output_dir}")
+    wanted = set()
+    converted = 0
+    for split_name, label, chip_id, path in _file_chips(dataset_dir):
+        png_path = os.path.join(output_dir, split_name, label, f"building_{chip_id}.png")
+        wanted.add(png_path)
+        if os.path.exists(png_path) and os.path.getmtime(png_path) >= os.path.getmtime(path):
+            continue
+        os.makedirs(os.path.dirname(png_path), exist_ok=True)
+        with open(png_path, "wb") as f:
+            f.write(encode_chip(read_chip_file(path), "png"))
+        converted += 1
+
+    removed = 0
+    for png_path in glob.glob(os.path.join(output_dir, "*", "*", "building_*.png")):
+        if png_path not in wanted:
+            os.remove(png_path)
+            removed += 1
+    logger.info(f"{converted} chips converted to PNG, {removed} stale PNGs removed")
+    return output_dir
+
+
+def png_layout_dir(dataset_dir):
+    """
+    Returns a directory with the PNG layout for dataset_dir (which YOLO
+    reads), exporting a chip store into dataset_dir/png on first use and
+    npy/zstd chip files into it on every call. Rewriting a chip store
+    removes its export, so it is never older than the store.
+    """
+    png_dir = png_export_dir(dataset_dir)
+    if has_chip_store(dataset_dir):
+        if not os.path.isdir(png_dir):
+            export_png_layout(dataset_dir, png_dir)
+        return png_dir
+    if next(_file_chips(dataset_dir), None) is not None:
+        return export_file_chips_png(dataset_dir, png_dir)
+    return dataset_dir
+
+
+def chip_keys(table, split_name, raster_checksum, params):
+    """
+    Content key per footprint: hash of the raster checksum, the footprint
+    geometry (as extracted), its split/label destination and the
+    extraction parameters. A chip is reusable only if its key is unchanged,
+    so one that moves to another split on a rerun is written again there.
+    """
+    base = hashlib.sha256()
+    base.update(raster_checksum.encode())
+    base.update(json.dumps(params, sort_keys=True, default=str).encode())
+
+    keys = []
+    for i, label in enumerate(table.labels):
+        h = base.copy()
+        h.update(table.wkb_at(i))
+        h.update(f"{split_name}/{label}".encode())
+        keys.append(h.hexdigest())
+    return keys
+
+
+class ManifestJournal(JsonlJournal):
+    """
+    JSON-lines record of chips written by one process, so a preempted job
+    keeps everything it finished.
+    """
+
+    def __init__(self, output_dir):
+        super().__init__(os.path.join(output_dir, f"manifest.{os.getpid()}.jsonl"))
+
+    def record(self, chip_id, key, path, size):
+        self.append({"chip_id": chip_id, "key": key, "path": path, "bytes": size})
+
+
+def is_manifest_file(filename):
+    """
+    True for the resume bookkeeping files (manifest.json and per-process
+    journals) kept next to the chips.
+    """
+    return filename.startswith("manifest.") and filename.endswith(
+        (".json", ".jsonl", ".tmp")
+    )
+
+
+def _manifest_records(output_dir):
+    path = os.path.join(output_dir, "manifest.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            yield from json.load(f)["chips"].items()
+    for journal in sorted(glob.glob(os.path.join(output_dir, "manifest.*.jsonl"))):
+        for entry in read_jsonl(journal):
+            yield entry.pop("chip_id"), entry
+
+
+def load_manifest(output_dir):
+    """
+    Returns {chip_id: entry} from manifest.json plus any journals left by
+    earlier (possibly interrupted) runs; later records win.
+    """
+    return dict(_manifest_records(output_dir))
+
+
+def is_valid_chip(output_dir, entry, key):
+    if entry is None or entry["key"] != key:
+        return False
+    path = os.path.join(output_dir, entry["path"])
+    return os.path.exists(path) and os.path.getsize(path) == entry["bytes"]
+
+
+def compact_manifest(output_dir, current_keys):
+    """
+    Folds journals into manifest.json, keeping only entries whose key is
+    the chip's current key in current_keys ({chip_id: key}), and deletes
+    chip files that no kept entry points to (dropped footprints, chips
+    that moved to another split or label).
+    """
+    records = list(_manifest_records(output_dir))
+    keep = {
+        cid: e
+        for cid, e in dict(records).items()
+        if current_keys.get(cid) == e["key"]
+    }
+    live = {e["path"] for e in keep.values()}
+
+    removed = 0
+    for path in {e["path"] for _, e in records} - live:
+        if os.path.exists(os.path.join(output_dir, path)):
+            os.remove(os.path.join(output_dir, path))
+            removed += 1
+
+    tmp_path = os.path.join(output_dir, "manifest.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"chips": keep}, f)
+    os.replace(tmp_path, os.path.join(output_dir, "manifest.json"))
+    for journal in glob.glob(os.path.join(output_dir, "manifest.*.jsonl")):
+        os.remove(journal)
+    logger.info(
+        f"Manifest: {len(keep)} chips tracked, {removed} stale chip files removed"
+    )
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import logging
+
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+
+logger = logging.getLogger("cog")
+
+COG_SUFFIX = "_cog.tif"
+
+
+def cog_path_for(raster_path):
+    """
+    Path of the Cloud-Optimized GeoTIFF written next to raster_path.
+    """
+    if raster_path.endswith(COG_SUFFIX):
+        return raster_path
+    return os.path.splitext(raster_path)[0] + COG_SUFFIX
+
+
+def cog_sidecar_path(cog_path):
+    return f"{cog_path}.json"
+
+
+def _cog_driver_available():
+    with rasterio.Env() as env:
+        return "COG" in env.drivers()
+
+
+def convert_to_cog(
+    src_path,
+    dst_path=None,
+    blocksize=512,
+    compress="DEFLATE",
+    overview_resampling="average",
+    overwrite=False,
+):
+    """
+    Rewrites a raster as an internally tiled, losslessly compressed COG with
+    overviews, and records the conversion in a JSON sidecar.
+
+    Full-resolution pixels are unchanged, so chips read from the COG match
+    the original. Uses GDAL's COG driver, or a tiled GTiff plus
+    build_overviews on GDAL builds without it.
+    """
+    dst_path = dst_path or cog_path_for(src_path)
+    sidecar = cog_sidecar_path(dst_path)
+    if os.path.exists(dst_path) and os.path.exists(sidecar) and not overwrite:
+        logger.info(f"COG already exists, skipping conversion: {dst_path}")
+        return dst_path
+
+    logger.info(f"Converting {src_path} -> {dst_path} (COG)")
+    start = time.perf_counter()
+    tmp_path = f"{dst_path}.tmp"
+
+    with rasterio.open(src_path) as src:
+        predictor = "3" if src.dtypes[0].startswith("float") else "2"
+        if _cog_driver_available():
+            driver = "COG"
+            rasterio.shutil.copy(
+                src,
+                tmp_path,
+                driver="COG",
+                BLOCKSIZE=str(blocksize),
+                COMPRESS=compress,
+                PREDICTOR=predictor,
+                OVERVIEWS="IGNORE_EXISTING",
+                RESAMPLING=overview_resampling.upper(),
+                BIGTIFF="IF_SAFER",
+                NUM_THREADS="ALL_CPUS",
+            )
+        else:
+            driver = "GTiff"
+            profile = src.profile
+            profile.update(
+                driver="GTiff",
+                tiled=True,
+                blockxsize=blocksize,
+                blockysize=blocksize,
+                compress=compress,
+                predictor=int(predictor),
+                BIGTIFF="IF_SAFER",
+            )
+            with rasterio.open(tmp_path, "w", **profile) as dst:
+                for _, window in dst.block_windows(1):
+                    dst.write(src.read(window=window), window=window)
+                factors = []
+                factor = 2
+                while max(src.width, src.height) // factor >= blocksize:
+                    factors.append(factor)
+                    factor *= 2
+                dst.build_overviews(factors, Resampling[overview_resampling])
+
+    os.replace(tmp_path, dst_path)
+    elapsed = time.perf_counter() - start
+
+    with rasterio.open(dst_path) as cog:
+        record = {
+            "source": os.path.basename(src_path),
+            "source_bytes": os.path.getsize(src_path),
+            "cog_bytes": os.path.getsize(dst_path),
+            "driver": driver,
+            "gdal_version": rasterio.__gdal_version__,
+            "blocksize": blocksize,
+            "compress": compress,
+            "predictor": predictor,
+            "overview_resampling": overview_resampling,
+            "overviews": cog.overviews(1),
+            "seconds": elapsed,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+    with open(sidecar, "w") as f:
+        json.dump(record, f, indent=2)
+    logger.info(
+        f"COG written in {elapsed:.1f}s ({record['source_bytes']} -> "
+        f"{record['cog_bytes']} bytes, overviews {record['overviews']})"
+    )
+    return dst_path
+
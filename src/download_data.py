@@ -1,9 +1,19 @@
 import os
 import logging
-import geopandas as gpd
 import fiona
 
-from utils import RAW_DIR, download_geotiff, download_file
+from utils import RESULTS_DIR, REMOTE_READS
+from feature_service import download_features
+from scene_catalog import register_scene, refresh_catalog
+from http_session import write_transfer_stats
+from asset_store import (
+    ASSET_DIR,
+    asset_cog,
+    asset_lock,
+    fetch_asset,
+    put_asset,
+    resolve_asset,
+)
 
 logger = logging.getLogger("download_data")
 
@@ -35,78 +45,67 @@ LAHAINA_FOOTPRINTS_URL = (
 
 def download_palisades_data():
     # download Palisades building footprint data
-    palisades_gpkg = os.path.join(RAW_DIR, "maxar_palisades_damage.gpkg")
-    download_file(PALISADES_FOOTPRINTS_URL, palisades_gpkg)
-
-    # testing
-    try:
-        layer_names = fiona.listlayers(PALISADES_FOOTPRINTS_URL)
-        layer_name = layer_names[0]
-    except Exception:
-        layer_name = None
-
-    if layer_name:
-        gdf_mx = gpd.read_file(PALISADES_FOOTPRINTS_URL, layer=layer_name)
-        gdf_mx.to_file(palisades_gpkg, driver="GPKG")
-        logger.info(f"Saved Palisades GPKG to {palisades_gpkg}")
-
-    palisades_sar = download_geotiff(PALISADES_SAR_URL, output_dir=RAW_DIR)
+    # the GPKG is read from disk from here on; fetching the URL again
+    # through GDAL would download it a second time
+    palisades_gpkg = fetch_asset(
+        "palisades_footprints",
+        PALISADES_FOOTPRINTS_URL,
+        filename="maxar_palisades_damage.gpkg",
+    )
+    logger.info(
+        f"Saved Palisades GPKG to {palisades_gpkg} "
+        f"(layers: {fiona.listlayers(palisades_gpkg)})"
+    )
+
+    if REMOTE_READS:
+        logger.info("REMOTE_READS set; Palisades SAR is read over HTTP")
+        return
+    palisades_sar = fetch_asset("palisades_sar", PALISADES_SAR_URL)
     logger.info(f"Palisades SAR saved at: {palisades_sar}")
+    palisades_cog = asset_cog("palisades_sar")
+    logger.info(f"Palisades SAR COG at: {palisades_cog}")
+    register_scene(palisades_cog)
 
 
 def download_lahaina_data():
-    # download Lahaina building footprint data
-    import geopandas as gpd
-    import requests
-
-    logger.info("Downloading Lahaina building footprints...")
-    gdf_list = []
-    offset = 0
-    page_size = 2000
-
-    count_params = {"where": "1=1", "returnCountOnly": "true", "f": "json"}
-    r = requests.get(LAHAINA_FOOTPRINTS_URL, params=count_params)
-    r.raise_for_status()
-    total_features = r.json()["count"]
-    logger.info(f"Total Lahaina features to download: {total_features}")
-
-    while offset < total_features:
-        logger.info(f"Fetching Lahaina features {offset}–{offset + page_size}")
-        query_params = {
-            "where": "1=1",
-            "outFields": "*",
-            "f": "geojson",
-            "resultOffset": offset,
-            "resultRecordCount": page_size,
-        }
-
-        page_url = (
-            f"{LAHAINA_FOOTPRINTS_URL}?"
-            + "&".join([f"{k}={v}" for k, v in query_params.items()])
-        )
-        page_gdf = gpd.read_file(page_url)
-        if page_gdf.empty:
-            break
-        gdf_list.append(page_gdf)
-        offset += len(page_gdf)
-
-    if not gdf_list:
-        raise RuntimeError("No Lahaina features downloaded.")
-
-    gdf_bldg = gpd.pd.concat(gdf_list, ignore_index=True)
-    lahaina_geojson = os.path.join(RAW_DIR, "lahaina_buildings.geojson")
-    gdf_bldg.to_file(lahaina_geojson, driver="GeoJSON")
+    # download Lahaina building footprint data (a feature service query
+    # has no ETag, so a stored copy is kept until removed)
+    with asset_lock("lahaina_footprints"):
+        lahaina_geojson = resolve_asset("lahaina_footprints")
+        if lahaina_geojson is None:
+            logger.info("Downloading Lahaina building footprints...")
+            gdf_bldg = download_features(LAHAINA_FOOTPRINTS_URL, page_size=2000)
+            if gdf_bldg.empty:
+                raise RuntimeError("No Lahaina features downloaded.")
+
+            staging = os.path.join(ASSET_DIR, "staging", "lahaina_buildings.geojson")
+            os.makedirs(os.path.dirname(staging), exist_ok=True)
+            gdf_bldg.to_file(staging, driver="GeoJSON")
+            lahaina_geojson = put_asset(
+                "lahaina_footprints", staging, url=LAHAINA_FOOTPRINTS_URL
+            )
     logger.info(f"Lahaina buildings saved to {lahaina_geojson}")
 
-    lahaina_sar = download_geotiff(LAHAINA_SAR_URL, output_dir=RAW_DIR)
+    if REMOTE_READS:
+        logger.info("REMOTE_READS set; Lahaina SAR is read over HTTP")
+        return
+    lahaina_sar = fetch_asset("lahaina_sar", LAHAINA_SAR_URL)
     logger.info(f"Lahaina SAR saved at: {lahaina_sar}")
+    lahaina_cog = asset_cog("lahaina_sar")
+    logger.info(f"Lahaina SAR COG at: {lahaina_cog}")
+    register_scene(lahaina_cog)
 
 
 def main():
     logger.info("Downloading raw data for Palisades and Lahaina...")
     download_palisades_data()
     download_lahaina_data()
+    # also picks up scenes downloaded before the catalog and drops removed ones
+    refresh_catalog()
     logger.info("All data downloads complete.")
+    write_transfer_stats(
+        os.path.join(RESULTS_DIR, "transfers_download.json"), "download_data"
+    )
 
 
 if __name__ == "__main__":
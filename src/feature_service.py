@@ -0,0 +1,117 @@
+import io
+import random
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import geopandas as gpd
+
+from http_session import get_session, get_json, read_body
+
+logger = logging.getLogger("feature_service")
+
+
+def feature_count(url, where="1=1", timeout=60):
+    """
+    Number of features an ArcGIS FeatureServer layer query would return.
+    """
+    params = {"where": where, "returnCountOnly": "true", "f": "json"}
+    return get_json(url, params=params, timeout=timeout)["count"]
+
+
+def _get_page(url, params, timeout):
+    with get_session().get(url, params=params, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        body = read_body(r)
+    # ArcGIS reports query errors as HTTP 200 with an error body
+    if b'"error"' in body[:64]:
+        raise IOError(f"FeatureServer error for {params}: {body[:200]!r}")
+    return body
+
+
+def _parse_page(body):
+    return gpd.read_file(io.BytesIO(body))
+
+
+async def _fetch_pages(url, total, where, page_size, concurrency, retries, timeout):
+    """
+    Fetches every page of the layer concurrently; returns (offset, page)
+    pairs in offset order.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    parse_pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def fetch(offset, count):
+        params = {
+            "where": where,
+            "outFields": "*",
+            "f": "geojson",
+            "resultOffset": offset,
+            "resultRecordCount": count,
+        }
+        for attempt in range(retries + 1):
+            try:
+                async with semaphore:
+                    body = await asyncio.to_thread(_get_page, url, params, timeout)
+                # parsed off the event loop while other pages download
+                page = await loop.run_in_executor(parse_pool, _parse_page, body)
+                if not 0 < len(page) <= count:
+                    # inside the advertised count, so a server hiccup
+                    raise IOError(
+                        f"Page at offset {offset} has {len(page)} features, "
+                        f"expected up to {count}"
+                    )
+                break
+            except (requests.RequestException, IOError) as e:
+                if attempt == retries:
+                    raise
+                delay = min(2**attempt, 30) * random.uniform(0.5, 1.0)
+                logger.warning(
+                    f"Page at offset {offset} failed ({e}); retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+        logger.info(f"Fetched features {offset}–{offset + len(page)} of {total}")
+        pages = [(offset, page)]
+        if len(page) < count:
+            # the server caps pages at its maxRecordCount; fetch the rest
+            pages += await fetch(offset + len(page), count - len(page))
+        return pages
+
+    try:
+        results = await asyncio.gather(
+            *(
+                fetch(offset, min(page_size, total - offset))
+                for offset in range(0, total, page_size)
+            )
+        )
+    finally:
+        parse_pool.shutdown()
+    return sorted((item for pages in results for item in pages), key=lambda p: p[0])
+
+
+def download_features(url, where="1=1", page_size=2000, concurrency=8, retries=4,
+                      timeout=120):
+    """
+    Downloads every feature of an ArcGIS FeatureServer layer query as a
+    GeoDataFrame, in service order.
+
+    The total from returnCountOnly fixes every page offset up front, so up
+    to concurrency pages are requested at once (retried with jittered
+    exponential backoff) and each GeoJSON page is parsed in a thread pool
+    as it arrives. An empty or oversized page is retried, and the result
+    must hold exactly the counted features.
+    """
+    total = feature_count(url, where=where, timeout=timeout)
+    logger.info(f"Total features to download: {total}")
+    pages = asyncio.run(
+        _fetch_pages(url, total, where, page_size, concurrency, retries, timeout)
+    )
+    if not pages:
+        return gpd.GeoDataFrame()
+    gdf = gpd.pd.concat([page for _, page in pages], ignore_index=True)
+    if len(gdf) != total:
+        raise IOError(f"Downloaded {len(gdf)} features, the service reported {total}")
+    return gdf
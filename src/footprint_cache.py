@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import logging
+
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import box
+
+from utils import PROCESSED_DIR, vector_layer_crs, vector_read_options
+from spatial_index import bbox_in_crs
+
+logger = logging.getLogger("footprint_cache")
+
+FOOTPRINT_CACHE_DIR = os.path.join(PROCESSED_DIR, "footprints")
+
+
+def footprint_cache_path(event):
+    return os.path.join(FOOTPRINT_CACHE_DIR, f"{event}.parquet")
+
+
+def _source_signature(path):
+    """
+    Size and mtime of a footprint source. FileGDBs are directories that
+    are re-extracted from their zip (resetting mtimes) on every run, so
+    theirs is the total size and file count instead.
+    """
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+    size, count = 0, 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            size += os.path.getsize(os.path.join(root, f))
+            count += 1
+    return {"size": size, "files": count}
+
+
+def build_footprint_cache(
+    event, source_path, layer=None, source_aoi=None, row_group_size=4096
+):
+    """
+    Converts an event's footprints to GeoParquet, sorted along a Hilbert
+    curve and written in small row groups with a bbox covering column, so
+    a bbox read only decodes row groups near it. Returns the cache key
+    written to the JSON sidecar.
+
+    source_aoi: GeoSeries/GeoDataFrame limiting what is read from the
+    source (its bbox is pushed down to the reader), for statewide layers.
+    """
+    bbox = None
+    if source_aoi is not None:
+        bbox = bbox_in_crs(source_aoi.geometry, vector_layer_crs(source_path, layer))
+
+    start = time.perf_counter()
+    gdf = gpd.read_file(source_path, layer=layer, bbox=bbox, **vector_read_options())
+    read_s = time.perf_counter() - start
+
+    # source order is restored on load, so splits do not depend on the cache
+    gdf["source_row"] = np.arange(len(gdf))
+    if len(gdf):
+        order = np.argsort(
+            gdf.geometry.hilbert_distance(total_bounds=gdf.total_bounds), kind="stable"
+        )
+        gdf = gdf.iloc[order]
+
+    path = footprint_cache_path(event)
+    os.makedirs(FOOTPRINT_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    gdf.to_parquet(tmp_path, write_covering_bbox=True, row_group_size=row_group_size)
+    os.replace(tmp_path, path)
+
+    key = {
+        "source": os.path.abspath(source_path),
+        "layer": layer,
+        "source_bbox": bbox,
+        "crs": gdf.crs.to_wkt() if gdf.crs is not None else None,
+        "bounds": [float(v) for v in gdf.total_bounds] if len(gdf) else None,
+        "signature": _source_signature(source_path),
+    }
+    with open(f"{path}.json", "w") as f:
+        json.dump(key, f, indent=2)
+    logger.info(
+        f"Cached {len(gdf)} {event} footprints -> {path} "
+        f"(source read {read_s:.1f}s)"
+    )
+    return key
+
+
+def _current_cache_key(event, source_path, layer, source_aoi):
+    """
+    The cache's sidecar key if it was built from this source, layer and
+    source AOI, else None.
+    """
+    path = footprint_cache_path(event)
+    if not (os.path.exists(path) and os.path.exists(f"{path}.json")):
+        return None
+    with open(f"{path}.json") as f:
+        key = json.load(f)
+    if "bounds" not in key:
+        # written before the extent was recorded
+        return None
+    if key.get("source") != os.path.abspath(source_path) or key.get("layer") != layer:
+        return None
+    if key.get("signature") != _source_signature(source_path):
+        return None
+    if source_aoi is None:
+        return key if key.get("source_bbox") is None else None
+    bbox = bbox_in_crs(source_aoi.geometry, vector_layer_crs(source_path, layer))
+    if key.get("source_bbox") is None or not np.allclose(key["source_bbox"], bbox):
+        return None
+    return key
+
+
+def load_footprints(event, source_path, layer=None, aoi=None, source_aoi=None):
+    """
+    Reads an event's footprints from its GeoParquet cache, (re)building it
+    from source_path when missing or stale.
+
+    aoi: GeoSeries/GeoDataFrame; only row groups whose bbox intersects its
+    bounds are read (returns every footprint whose bbox intersects them,
+    for the caller's exact filter). Rows come back in source order.
+    """
+    key = _current_cache_key(event, source_path, layer, source_aoi)
+    if key is None:
+        key = build_footprint_cache(
+            event, source_path, layer=layer, source_aoi=source_aoi
+        )
+
+    path = footprint_cache_path(event)
+    bbox = None
+    if aoi is not None:
+        bbox = bbox_in_crs(aoi.geometry, key["crs"])
+
+    start = time.perf_counter()
+    gdf = gpd.read_parquet(path, bbox=bbox)
+    gdf = gdf.sort_values("source_row").set_index("source_row")
+    gdf.index.name = None
+    gdf = gdf.drop(columns="bbox", errors="ignore")
+    logger.info(
+        f"Loaded {len(gdf)} {event} footprints from cache in "
+        f"{time.perf_counter() - start:.2f}s"
+    )
+    return gdf
+
+
+def footprint_extent(event, source_path, layer=None, source_aoi=None):
+    """
+    Bounding box of all an event's footprints as a one-row GeoSeries in
+    the footprint CRS, from the cache sidecar (building the cache if
+    needed), or None when there are no footprints.
+    """
+    key = _current_cache_key(event, source_path, layer, source_aoi)
+    if key is None:
+        key = build_footprint_cache(
+            event, source_path, layer=layer, source_aoi=source_aoi
+        )
+    if key["bounds"] is None:
+        return None
+    return gpd.GeoSeries([box(*key["bounds"])], crs=key["crs"])
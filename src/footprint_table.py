@@ -0,0 +1,108 @@
+import numpy as np
+import shapely
+
+from chip_extraction import is_rectilinear, footprint_windows
+
+SPLIT_NAMES = ("train", "val", "test")
+
+
+class FootprintTable:
+    """
+    Columnar footprint set for the extraction loop: ids, labels, split
+    codes, map bounds, pixel windows and WKB geometries packed into one
+    byte buffer with offsets.
+
+    Built once from a GeoDataFrame; subsets (splits, spatial order,
+    pending chips, worker shards) are taken with take() without going back
+    through pandas or shapely objects.
+    """
+
+    def __init__(self, ids, labels, split, bounds, windows, wkb, offsets, keys=None):
+        self.ids = ids
+        self.labels = labels
+        self.split = split
+        self.bounds = bounds
+        self.windows = windows
+        self.wkb = wkb
+        self.offsets = offsets
+        self.keys = keys
+
+    @classmethod
+    def from_geodataframe(cls, gdf, src=None, split=None):
+        """
+        Converts gdf (index = chip id, 'geometry', 'label') in the raster's
+        CRS. Pixel windows are computed when src has a north-up transform.
+        split: optional split code per row (index into SPLIT_NAMES).
+        """
+        geoms = gdf.geometry.values
+        blobs = shapely.to_wkb(np.asarray(geoms))
+        lengths = np.fromiter((len(b) for b in blobs), dtype=np.int64, count=len(blobs))
+        offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        wkb = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+
+        windows = None
+        if src is not None and is_rectilinear(src.transform):
+            windows = footprint_windows(geoms, src)
+        if split is None:
+            split = np.zeros(len(gdf), dtype=np.int8)
+        return cls(
+            ids=np.asarray(gdf.index.astype(str), dtype=str),
+            labels=gdf["label"].to_numpy(),
+            split=np.asarray(split, dtype=np.int8),
+            bounds=shapely.bounds(np.asarray(geoms)),
+            windows=windows,
+            wkb=wkb,
+            offsets=offsets,
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        arrays = [self.ids, self.labels, self.split, self.bounds, self.wkb, self.offsets]
+        arrays += [a for a in (self.windows, self.keys) if a is not None]
+        return sum(a.nbytes for a in arrays)
+
+    def wkb_at(self, i):
+        return self.wkb[self.offsets[i] : self.offsets[i + 1]].tobytes()
+
+    def geometries(self):
+        """
+        Decodes every footprint to a shapely geometry array.
+        """
+        return shapely.from_wkb([self.wkb_at(i) for i in range(len(self))])
+
+    def take(self, positions):
+        """
+        Table of the rows at positions (integer array or boolean mask), in
+        that order.
+        """
+        positions = np.arange(len(self))[positions]
+        starts = self.offsets[positions]
+        lengths = self.offsets[positions + 1] - starts
+        offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # byte positions of every selected blob, concatenated
+        gather = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return FootprintTable(
+            ids=self.ids[positions],
+            labels=self.labels[positions],
+            split=self.split[positions],
+            bounds=self.bounds[positions],
+            windows=None if self.windows is None else self.windows[positions],
+            wkb=self.wkb[gather],
+            offsets=offsets,
+            keys=None if self.keys is None else self.keys[positions],
+        )
+
+    def split_tables(self):
+        """
+        (split name, table) for every non-empty split, in SPLIT_NAMES order.
+        """
+        return [
+            (name, self.take(self.split == code))
+            for code, name in enumerate(SPLIT_NAMES)
+            if np.any(self.split == code)
+        ]
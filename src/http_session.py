@@ -0,0 +1,144 @@
+import os
+import io
+import json
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger("http_session")
+
+# connections kept alive per host; at least the range/page concurrency
+POOL_SIZE = 32
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class TransferStats:
+    """
+    Bytes moved over HTTP by this process, and bytes a download reused
+    from disk or from a concurrent request for the same file instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes_transferred = 0
+        self.bytes_reused = 0
+        self.files_reused = 0
+
+    def add_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def add_transferred(self, n):
+        with self._lock:
+            self.bytes_transferred += n
+
+    def add_reused(self, n):
+        with self._lock:
+            self.bytes_reused += n
+            self.files_reused += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "bytes_transferred": self.bytes_transferred,
+                "bytes_reused": self.bytes_reused,
+                "files_reused": self.files_reused,
+            }
+
+
+transfer_stats = TransferStats()
+
+
+def _retry():
+    """
+    Retries connection errors and throttling/5xx replies to GET and HEAD
+    with exponential backoff (0.5 s, 1 s, 2 s, ... capped at 30 s),
+    jittered so concurrent requests do not retry in lockstep.
+    """
+    kwargs = dict(
+        total=5,
+        backoff_factor=0.5,
+        backoff_max=30,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+    )
+    try:
+        return Retry(backoff_jitter=0.5, **kwargs)
+    except TypeError:
+        # urllib3 < 2 has no jitter or backoff cap
+        kwargs.pop("backoff_max")
+        return Retry(**kwargs)
+
+
+def get_session():
+    """
+    The process's shared requests.Session: one keep-alive connection pool
+    per host with retries. Forked workers get their own, since pooled
+    sockets cannot be shared across processes.
+    """
+    pid = os.getpid()
+    with _sessions_lock:
+        session = _sessions.get(pid)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=8, pool_maxsize=POOL_SIZE, max_retries=_retry()
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.hooks["response"].append(lambda r, *a, **k: transfer_stats.add_request())
+            _sessions[pid] = session
+        return session
+
+
+def iter_body(response, chunk_size=1024 * 1024):
+    """
+    Streams a response body (requested with stream=True) in chunks,
+    counting them in transfer_stats.
+    """
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        transfer_stats.add_transferred(len(chunk))
+        yield chunk
+
+
+def read_body(response):
+    """
+    A streamed response's whole body as bytes, for small documents (JSON,
+    GeoJSON pages).
+    """
+    buf = io.BytesIO()
+    for chunk in iter_body(response):
+        buf.write(chunk)
+    return buf.getvalue()
+
+
+def get_json(url, params=None, timeout=60):
+    with get_session().get(url, params=params, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        return json.loads(read_body(r))
+
+
+def write_transfer_stats(path, run):
+    """
+    Logs this process's transfer totals and writes them to path as JSON.
+    """
+    stats = dict(run=run, **transfer_stats.as_dict())
+    logger.info(
+        f"{run}: {stats['requests']} requests, "
+        f"{stats['bytes_transferred'] / 1e6:.1f} MB transferred, "
+        f"{stats['bytes_reused'] / 1e6:.1f} MB reused "
+        f"({stats['files_reused']} files)"
+    )
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(stats, f, indent=2)
+    return stats
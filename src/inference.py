@@ -1,6 +1,5 @@
 import os
 import logging
-import uuid
 
 import geopandas as gpd
 from shapely import wkt
@@ -11,15 +10,25 @@ from ultralytics import YOLO
 from utils import (
     RAW_DIR,
     DATASETS_DIR,
+    PREPROCESS_WORKERS,
+    CHIP_NORMALIZATION,
+    CHIP_FORMAT,
+    CHIP_WRITE_THREADS,
+    AOI_CACHE_BYTES,
+    REMOTE_READS,
     RESULTS_DIR,
     MODELS_DIR,
-    download_geotiff,
-    download_file,
     unzip_file,
-    query_gdb_contained_by_polygon,
-    build_valid_data_boundary,
+    load_or_build_valid_data_boundary,
     prepare_sar_dataset,
+    prepare_footprints,
 )
+from chip_store import png_layout_dir
+from asset_store import asset_cog, asset_lock, fetch_asset
+from remote_raster import configure_remote_reads, remote_path
+from spatial_index import aoi_envelope, filter_within
+from footprint_cache import load_footprints
+from http_session import write_transfer_stats
 
 logger = logging.getLogger("inference")
 
@@ -42,14 +51,21 @@ CO_WKT = (
 
 
 def prepare_marshall_test_dataset():
-    # download SAR data
-    sar_path = download_geotiff(MARSHALL_SAR_URL, output_dir=RAW_DIR)
+    # SAR data: read in place over HTTP, or downloaded and converted to COG
+    if REMOTE_READS:
+        configure_remote_reads()
+        sar_path = remote_path(MARSHALL_SAR_URL)
+    else:
+        fetch_asset("marshall_sar", MARSHALL_SAR_URL)
+        sar_path = asset_cog("marshall_sar")
 
     # dowload building footprints
-    zip_path = os.path.join(RAW_DIR, "co_structures.zip")
-    download_file(MARSHALL_FOOTPRINTS_URL, zip_path)
+    zip_path = fetch_asset(
+        "marshall_footprints", MARSHALL_FOOTPRINTS_URL, filename="co_structures.zip"
+    )
     extract_dir = os.path.join(RAW_DIR, "co_structures")
-    unzip_file(zip_path, extract_dir)
+    with asset_lock("co_structures"):
+        unzip_file(zip_path, extract_dir)
 
     # Find GDB path
     gdb_path = None
@@ -69,42 +85,28 @@ def prepare_marshall_test_dataset():
     p = wkt.loads(CO_WKT)
     polygon_gdf = gpd.GeoDataFrame([1], geometry=[p], crs="EPSG:4326")
 
-    contained_features = query_gdb_contained_by_polygon(
-        gdb_path, layer_name, polygon_gdf
+    # the statewide layer is only read around the AOI, once; reruns load
+    # the cached GeoParquet
+    footprints = load_footprints(
+        "marshall", gdb_path, layer=layer_name, aoi=polygon_gdf, source_aoi=polygon_gdf
     )
-    contained_features = contained_features.explode(index_parts=False)
-
-    gdf_co = contained_features.copy()
-    gdf_co = gdf_co.to_crs("EPSG:32610")
-    gdf_co["geometry"] = gdf_co.buffer(5)
-
-    gdf_co["label"] = 0
-
-    ids = [str(uuid.uuid4()) for _ in range(len(gdf_co))]
-    gdf_co.index = ids
-    gdf_co.index.name = "id"
+    if footprints.crs != polygon_gdf.crs:
+        footprints = footprints.to_crs(polygon_gdf.crs)
+    contained_features = filter_within(footprints, p).assign(label=0)
 
     # build AOI bounding box for cropping + valid data boundary
     with rasterio.open(sar_path) as src:
-        if gdf_co.crs != src.crs:
-            gdf_co = gdf_co.to_crs(src.crs)
-
-        all_polygons_merged = gdf_co.unary_union
-        bounding_box = all_polygons_merged.envelope
-        gdf_aoi = gpd.GeoDataFrame.from_features(
-            [{"geometry": bounding_box, "properties": {"name": "marshall_aoi"}}],
-            crs=gdf_co.crs,
-        )
+        gdf_co = prepare_footprints(contained_features, src, explode=True)
 
-        aoi_boundary = gdf_aoi.unary_union
-        valid_data_boundary = build_valid_data_boundary(src)
+        aoi_boundary = aoi_envelope(gdf_co.geometry)
+        valid_data_boundary = load_or_build_valid_data_boundary(sar_path)
         final_boundary = aoi_boundary.intersection(valid_data_boundary)
 
         if final_boundary.is_empty:
             logger.warning("AOI and valid SAR data do not overlap; no chips generated.")
             return None, None
 
-        gdf_fully_inside = gdf_co[gdf_co.within(final_boundary)].copy()
+        gdf_fully_inside = filter_within(gdf_co, final_boundary).copy()
 
     dataset_dir = os.path.join(DATASETS_DIR, "marshall_test_dataset")
     prepare_sar_dataset(
@@ -114,9 +116,14 @@ def prepare_marshall_test_dataset():
         target_size=(224, 224),
         split_ratios=(0.0, 0.0, 1.0),
         random_state=42,
+        num_workers=PREPROCESS_WORKERS,
+        normalization=CHIP_NORMALIZATION,
+        output_format=CHIP_FORMAT,
+        writer_options={"write_threads": CHIP_WRITE_THREADS},
+        aoi_cache_bytes=AOI_CACHE_BYTES,
     )
 
-    return dataset_dir, gdf_fully_inside
+    return png_layout_dir(dataset_dir), gdf_fully_inside
 
 
 def run_inference_on_marshall():
@@ -165,6 +172,9 @@ def main():
     logger.info("Running inference on Marshall wildfire building area...")
     run_inference_on_marshall()
     logger.info("Inference complete.")
+    write_transfer_stats(
+        os.path.join(RESULTS_DIR, "transfers_inference.json"), "inference"
+    )
 
 
 if __name__ == "__main__":
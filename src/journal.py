@@ -0,0 +1,36 @@
+import json
+import threading
+
+
+class JsonlJournal:
+    """
+    Append-only JSON-lines file, flushed per record so a killed process
+    keeps everything it recorded. Safe to append to from several threads.
+    """
+
+    def __init__(self, path, mode="a"):
+        self.path = path
+        self._file = open(path, mode)
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        line = json.dumps(record)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_jsonl(path):
+    """
+    Records of a JSON-lines journal, in order.
+    """
+    with open(path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # torn last line from a killed process
+                continue
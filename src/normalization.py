@@ -0,0 +1,325 @@
+import os
+import json
+import logging
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from remote_raster import is_remote, remote_key, remote_sidecar_path
+
+logger = logging.getLogger("normalization")
+
+
+class ScratchBuffers:
+    """
+    Grow-only scratch buffers reused across chips, one per dtype.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, dtype, shape):
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        buf = self._buffers.get(dtype)
+        if buf is None or buf.size < size:
+            buf = np.empty(size, dtype=dtype)
+            self._buffers[dtype] = buf
+        return buf[:size].reshape(shape)
+
+
+def stretch_and_pad(
+    chips,
+    target_size,
+    out=None,
+    percentiles=(2, 98),
+    scratch=None,
+    bounds=None,
+    lut=None,
+):
+    """
+    Percentile-stretches a batch of chips to uint8 and centres each on a
+    zero canvas of target_size, writing into one (N, H, W) buffer.
+
+    Pixel-for-pixel equal to the per-chip stretch in _process_and_save:
+    the same clip/rescale expressions run in place on reused scratch
+    buffers of the dtype numpy would have picked for the temporaries.
+    Every chip must fit inside target_size.
+
+    bounds: fixed scene-level (vmin, vmax) instead of per-chip percentiles
+    lut: optional stretch_lut(chip dtype, *bounds) replacing the arithmetic
+    """
+    n = len(chips)
+    if out is None:
+        out = np.zeros((n,) + tuple(target_size), dtype=np.uint8)
+    else:
+        out = out[:n]
+        out.fill(0)
+    if scratch is None:
+        scratch = ScratchBuffers()
+
+    for i, chip in enumerate(chips):
+        h, w = chip.shape
+        y_off = (target_size[0] - h) // 2
+        x_off = (target_size[1] - w) // 2
+        dest = out[i, y_off : y_off + h, x_off : x_off + w]
+
+        if bounds is not None:
+            if lut is not None:
+                unsigned = chip.view(f"u{chip.dtype.itemsize}")
+                np.take(lut, unsigned, out=dest, mode="clip")
+            else:
+                work = scratch.get(np.float64, chip.shape)
+                _fixed_stretch(chip, bounds[0], bounds[1], dest, work)
+            continue
+
+        valid = np.not_equal(chip, 0, out=scratch.get(np.bool_, chip.shape))
+        count = np.count_nonzero(valid)
+        if count == 0:
+            continue
+
+        values = np.compress(
+            valid.ravel(), chip.ravel(), out=scratch.get(chip.dtype, (count,))
+        )
+        vmin, vmax = np.percentile(values, percentiles, overwrite_input=True)
+        if not vmax > vmin:
+            dest.fill(128)
+            continue
+
+        work_dtype = np.result_type(chip, vmin, vmax)
+        if np.result_type(work_dtype, vmin) != work_dtype:
+            # mixed-precision corner case; keep numpy's own temporaries
+            scaled = (np.clip(chip, vmin, vmax) - vmin) / (vmax - vmin) * 255
+            dest[...] = scaled.astype(np.uint8)
+            continue
+
+        work = scratch.get(work_dtype, chip.shape)
+        np.clip(chip, vmin, vmax, out=work)
+        np.subtract(work, vmin, out=work)
+        np.divide(work, vmax - vmin, out=work)
+        np.multiply(work, 255, out=work)
+        # same truncating float -> uint8 cast as astype
+        np.copyto(dest, work, casting="unsafe")
+
+    return out
+
+
+class StreamingHistogram:
+    """
+    One-pass histogram of raster intensities.
+
+    Integer rasters of up to 16 bits get one bin per value, so percentiles
+    are exact. Wider and float rasters use a fixed number of bins whose
+    range doubles (merging neighbour bins) whenever new values fall
+    outside it.
+    """
+
+    def __init__(self, dtype, bins=4096):
+        dtype = np.dtype(dtype)
+        self.dtype = dtype.name
+        if dtype.kind in "ui" and dtype.itemsize <= 2:
+            self.exact = True
+            self.lo = float(np.iinfo(dtype).min)
+            self.width = 1.0
+            self.counts = np.zeros(2 ** (8 * dtype.itemsize), dtype=np.int64)
+        else:
+            self.exact = False
+            self.lo = None
+            self.width = None
+            self.counts = np.zeros(bins, dtype=np.int64)
+
+    def update(self, values):
+        if values.size == 0:
+            return
+        if self.exact:
+            offsets = values.astype(np.int64) - int(self.lo)
+            self.counts += np.bincount(offsets, minlength=self.counts.size)
+            return
+
+        values = values.astype(np.float64, copy=False)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+        vmin, vmax = float(values.min()), float(values.max())
+        bins = self.counts.size
+        if self.lo is None:
+            self.lo = vmin
+            self.width = (vmax - vmin) / bins if vmax > vmin else max(abs(vmin), 1.0) * 1e-6
+        while vmin < self.lo or vmax >= self.lo + self.width * bins:
+            merged = self.counts.reshape(-1, 2).sum(axis=1)
+            self.counts = np.zeros(bins, dtype=np.int64)
+            if vmin < self.lo:
+                self.counts[bins // 2 :] = merged
+                self.lo -= (bins // 2) * self.width * 2
+            else:
+                self.counts[: bins // 2] = merged
+            self.width *= 2
+
+        idx = ((values - self.lo) / self.width).astype(np.int64)
+        np.clip(idx, 0, bins - 1, out=idx)
+        self.counts += np.bincount(idx, minlength=bins)
+
+    def percentile(self, q):
+        """
+        Percentile q (0-100) of everything seen so far. Matches
+        np.percentile's linear interpolation in exact mode.
+        """
+        cum = np.cumsum(self.counts)
+        total = int(cum[-1]) if cum.size else 0
+        if total == 0:
+            raise ValueError("Histogram is empty.")
+
+        if self.exact:
+            rank = q / 100 * (total - 1)
+            below, above = np.searchsorted(
+                cum, [np.floor(rank), np.ceil(rank)], side="right"
+            )
+            v_below, v_above = self.lo + below, self.lo + above
+            return v_below + (v_above - v_below) * (rank - np.floor(rank))
+
+        target = q / 100 * total
+        i = min(int(np.searchsorted(cum, target, side="left")), cum.size - 1)
+        start = cum[i] - self.counts[i]
+        within = (target - start) / self.counts[i] if self.counts[i] else 0.0
+        return self.lo + (i + within) * self.width
+
+    def to_dict(self):
+        return {
+            "dtype": self.dtype,
+            "exact": self.exact,
+            "lo": self.lo,
+            "width": self.width,
+            "counts": self.counts.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        hist = cls(d["dtype"], bins=len(d["counts"]))
+        hist.exact = d["exact"]
+        hist.lo = d["lo"]
+        hist.width = d["width"]
+        hist.counts = np.asarray(d["counts"], dtype=np.int64)
+        return hist
+
+
+def compute_scene_histogram(src, decimation=1, strip_rows=2048, region=None):
+    """
+    Streams the raster's valid (unmasked, non-zero) pixels into a
+    StreamingHistogram, block by block.
+
+    decimation > 1 reads strips with out_shape so GDAL can serve them
+    from overviews instead of full-resolution blocks. region, a
+    (row_off, col_off, height, width) window, limits the histogram to it.
+    """
+    hist = StreamingHistogram(src.dtypes[0])
+
+    if decimation > 1 or region is not None:
+        row_off, col_off, height, width = region or (0, 0, src.height, src.width)
+        step = strip_rows * decimation
+        windows = (
+            Window(col_off, row, width, min(step, row_off + height - row))
+            for row in range(row_off, row_off + height, step)
+        )
+    else:
+        windows = (window for _, window in src.block_windows(1))
+
+    for window in windows:
+        out_shape = None
+        if decimation > 1:
+            out_shape = (
+                max(int(window.height) // decimation, 1),
+                max(int(window.width) // decimation, 1),
+            )
+        data = src.read(1, window=window, out_shape=out_shape, masked=True)
+        values = data.compressed()
+        hist.update(values[values != 0])
+    return hist
+
+
+def _histogram_path(raster_path):
+    if is_remote(raster_path):
+        return remote_sidecar_path(raster_path, ".hist.json")
+    return f"{raster_path}.hist.json"
+
+
+def load_or_compute_scene_histogram(raster_path, decimation=1, aoi_region=None):
+    """
+    Returns the raster's scene histogram, reusing the JSON sidecar next to
+    the raster when it was built from the same file and decimation.
+
+    Remote (/vsicurl/) rasters are histogrammed over aoi_region only, at
+    full resolution, so the scene is not fetched whole. (Averaged
+    overviews would narrow the distribution and shift the stretch.)
+    """
+    region = None
+    if is_remote(raster_path):
+        region = aoi_region
+        if region is None:
+            logger.warning(f"No AOI for {raster_path}; its histogram reads every block")
+        key = {"remote": remote_key(raster_path), "decimation": decimation}
+        if region is not None:
+            key["region"] = [int(v) for v in region]
+    else:
+        stat = os.stat(raster_path)
+        key = {"size": stat.st_size, "mtime": stat.st_mtime, "decimation": decimation}
+    sidecar = _histogram_path(raster_path)
+
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return StreamingHistogram.from_dict(cached["histogram"])
+
+    logger.info(f"Computing scene histogram for {raster_path}")
+    with rasterio.open(raster_path) as src:
+        hist = compute_scene_histogram(src, decimation=decimation, region=region)
+
+    with open(sidecar, "w") as f:
+        json.dump({"key": key, "histogram": hist.to_dict()}, f)
+    logger.info(f"Saved scene histogram: {sidecar}")
+    return hist
+
+
+def scene_stretch_bounds(raster_path, percentiles=(2, 98), decimation=1, aoi_region=None):
+    """
+    Scene-level (vmin, vmax) for a fixed stretch of every chip.
+    """
+    hist = load_or_compute_scene_histogram(
+        raster_path, decimation=decimation, aoi_region=aoi_region
+    )
+    vmin, vmax = (float(hist.percentile(q)) for q in percentiles)
+    logger.info(f"Scene stretch bounds for {raster_path}: {vmin:.4g} - {vmax:.4g}")
+    return vmin, vmax
+
+
+def stretch_lut(dtype, vmin, vmax):
+    """
+    uint8 lookup table for a fixed (vmin, vmax) stretch of an 8/16-bit
+    integer dtype, indexed by the chip viewed as unsigned; None when the
+    dtype is too wide for a table.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind not in "ui" or dtype.itemsize > 2:
+        return None
+    unsigned = np.dtype(f"u{dtype.itemsize}")
+    values = np.arange(2 ** (8 * dtype.itemsize), dtype=np.int64)
+    values = values.astype(unsigned).view(dtype)
+    lut = np.empty(values.shape, dtype=np.uint8)
+    _fixed_stretch(values, vmin, vmax, lut, np.empty(values.shape, np.float64))
+    return lut
+
+
+def _fixed_stretch(chip, vmin, vmax, dest, work):
+    """
+    Fixed-bounds stretch of chip into dest, computed in float64 work.
+    """
+    if not vmax > vmin:
+        dest.fill(128)
+        return
+    np.copyto(work, chip, casting="unsafe")
+    np.clip(work, vmin, vmax, out=work)
+    np.subtract(work, vmin, out=work)
+    np.divide(work, vmax - vmin, out=work)
+    np.multiply(work, 255, out=work)
+    np.copyto(dest, work, casting="unsafe")
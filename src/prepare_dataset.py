@@ -3,6 +3,7 @@ import yaml
 import logging
 
 from utils import DATASETS_DIR, merge_and_copy_directories
+from chip_store import png_layout_dir
 
 logger = logging.getLogger("prepare_dataset")
 
@@ -18,7 +19,9 @@ def main():
         raise FileNotFoundError(lahaina_dir)
 
     logger.info("Merging Palisades & Lahaina datasets...")
-    merge_and_copy_directories(palisades_dir, lahaina_dir, merged_dir)
+    merge_and_copy_directories(
+        png_layout_dir(palisades_dir), png_layout_dir(lahaina_dir), merged_dir
+    )
 
     yaml_path = os.path.join(DATASETS_DIR, "data.yaml")
     with open(yaml_path, "w") as f:
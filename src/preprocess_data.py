@@ -1,5 +1,4 @@
 import os
-import uuid
 import logging
 import geopandas as gpd
 import rasterio
@@ -8,110 +7,139 @@ from shapely.geometry import box
 from utils import (
     RAW_DIR,
     DATASETS_DIR,
+    PREPROCESS_WORKERS,
+    CHIP_NORMALIZATION,
+    CHIP_FORMAT,
+    CHIP_WRITE_THREADS,
+    AOI_CACHE_BYTES,
+    REMOTE_READS,
     prepare_sar_dataset,
+    prepare_footprints,
 )
+from scene_catalog import find_scenes_for_aoi
+from footprint_cache import load_footprints, footprint_extent
+from asset_store import resolve_asset
+from remote_raster import configure_remote_reads, remote_path
+from download_data import PALISADES_SAR_URL, LAHAINA_SAR_URL
 
 logger = logging.getLogger("preprocess_data")
 
 
-def build_palisades_dataset():
-    palisades_gpkg = os.path.join(RAW_DIR, "maxar_palisades_damage.gpkg")
-    palisades_sar = None
+def scene_aoi(scene):
+    """
+    A catalogued scene's raster bounds as a GeoSeries in its CRS.
+    """
+    return gpd.GeoSeries([box(*scene["bounds"])], crs=scene["crs"])
+
+
+def find_scene(footprint_aoi, url):
+    """
+    Path, bounds and CRS of the scene for an event: opened over HTTP from
+    url when REMOTE_READS is set (only its header is fetched), else the
+    catalogued scene that best covers footprint_aoi (None when no
+    downloaded scene meets it).
+    """
+    if REMOTE_READS:
+        configure_remote_reads()
+        path = remote_path(url)
+        with rasterio.open(path) as src:
+            return {"path": path, "bounds": src.bounds, "crs": src.crs.to_wkt()}
+    if footprint_aoi is None:
+        return None
+    scenes = find_scenes_for_aoi(footprint_aoi)
+    if not scenes:
+        return None
+    logger.info(
+        f"Scene {scenes[0]['scene_id']} selected from {len(scenes)} covering "
+        "the footprints"
+    )
+    return scenes[0]
 
-    for f in os.listdir(RAW_DIR):
-        if "CAPELLA_C14_SS_GEO_HH_20250111163649" in f and f.endswith(".tif"):
-            palisades_sar = os.path.join(RAW_DIR, f)
-            break
-    if palisades_sar is None:
-        raise FileNotFoundError("Palisades SAR data not found in RAW_DIR")
 
-    gdf_mx = gpd.read_file(palisades_gpkg)
+def footprint_source(asset_name, filename):
+    """
+    Stored footprint asset by logical name, or the bare RAW_DIR file name
+    of downloads made before the asset store.
+    """
+    return resolve_asset(asset_name) or os.path.join(RAW_DIR, filename)
 
-    # label column
-    gdf_mx["label"] = gdf_mx["damaged"]
 
-    # project and buffer
-    gdf_mx = gdf_mx.to_crs("EPSG:32611")
-    gdf_mx["geometry"] = gdf_mx.buffer(5)
+def build_palisades_dataset():
+    palisades_gpkg = footprint_source(
+        "palisades_footprints", "maxar_palisades_damage.gpkg"
+    )
+    palisades_scene = find_scene(
+        footprint_extent("palisades", palisades_gpkg), PALISADES_SAR_URL
+    )
+    if palisades_scene is None:
+        raise FileNotFoundError(
+            "No catalogued SAR scene covers the Palisades footprints; "
+            "run download_data.py"
+        )
+    palisades_sar = palisades_scene["path"]
 
-    # UUID index
-    uuids = [str(uuid.uuid4()) for _ in range(len(gdf_mx))]
-    gdf_mx.index = uuids
-    gdf_mx.index.name = "uuid"
-    gdf_mx = gdf_mx[["geometry", "label"]]
+    # only footprints whose bbox meets the scene's are read from the cache
+    gdf_mx = load_footprints("palisades", palisades_gpkg, aoi=scene_aoi(palisades_scene))
 
-    with rasterio.open(palisades_sar) as src:
-        if gdf_mx.crs != src.crs:
-            gdf_mx = gdf_mx.to_crs(src.crs)
-
-        # AOI bounding box
-        all_polygons_merged = gdf_mx.unary_union
-        bounding_box = all_polygons_merged.envelope
-        aoi_gdf = gpd.GeoDataFrame.from_features(
-            [{"geometry": bounding_box, "properties": {"name": "palisades_aoi"}}],
-            crs=gdf_mx.crs,
-        )
+    # label column
+    gdf_mx["label"] = gdf_mx["damaged"]
 
-        aoi_boundary = aoi_gdf.unary_union
-        gdf_fully_inside = gdf_mx[gdf_mx.within(aoi_boundary)].copy()
+    with rasterio.open(palisades_sar) as src:
+        # raster CRS, 5 m buffer, pixel-scale simplification, id index
+        gdf_mx = prepare_footprints(gdf_mx, src)
 
+    # every footprint is within its own envelope, so no AOI filter here;
+    # prepare_sar_dataset keeps those within the raster
     dataset_dir = os.path.join(DATASETS_DIR, "palisades_building_dataset")
     prepare_sar_dataset(
-        gdf_fully_inside,
+        gdf_mx,
         palisades_sar,
         dataset_dir,
         target_size=(224, 224),
         split_ratios=(0.7, 0.15, 0.15),
         random_state=42,
+        num_workers=PREPROCESS_WORKERS,
+        normalization=CHIP_NORMALIZATION,
+        output_format=CHIP_FORMAT,
+        writer_options={"write_threads": CHIP_WRITE_THREADS},
+        aoi_cache_bytes=AOI_CACHE_BYTES,
     )
     logger.info(f"Palisades dataset prepared at: {dataset_dir}")
 
 
 def build_lahaina_dataset():
-    lahaina_geojson = os.path.join(RAW_DIR, "lahaina_buildings.geojson")
-    lahaina_sar = None
-    
-    for f in os.listdir(RAW_DIR):
-        if "CAPELLA_C06_SP_GEO_HH_20230812045610" in f and f.endswith(".tif"):
-            lahaina_sar = os.path.join(RAW_DIR, f)
-            break
-    if lahaina_sar is None:
-        raise FileNotFoundError("Lahaina SAR .tif not found in RAW_DIR")
-
-    gdf_bldg = gpd.read_file(lahaina_geojson)
-
-    gdf_bldg = gdf_bldg.to_crs("EPSG:32604")
-    gdf_bldg["geometry"] = gdf_bldg.buffer(5)
+    lahaina_geojson = footprint_source("lahaina_footprints", "lahaina_buildings.geojson")
+    lahaina_scene = find_scene(
+        footprint_extent("lahaina", lahaina_geojson), LAHAINA_SAR_URL
+    )
+    if lahaina_scene is None:
+        raise FileNotFoundError(
+            "No catalogued SAR scene covers the Lahaina footprints; "
+            "run download_data.py"
+        )
+    lahaina_sar = lahaina_scene["path"]
+
+    gdf_bldg = load_footprints("lahaina", lahaina_geojson, aoi=scene_aoi(lahaina_scene))
+
     # map ClassLabel to binary
     gdf_bldg["label"] = gdf_bldg["ClassLabel"].map({"Damaged": 1, "Undamaged": 0})
 
-    uuids = [str(uuid.uuid4()) for _ in range(len(gdf_bldg))]
-    gdf_bldg.index = uuids
-    gdf_bldg.index.name = "uuid"
-    gdf_bldg = gdf_bldg[["geometry", "label"]]
-
     with rasterio.open(lahaina_sar) as src:
-        if gdf_bldg.crs != src.crs:
-            gdf_bldg = gdf_bldg.to_crs(src.crs)
-
-        all_polygons_merged = gdf_bldg.unary_union
-        bounding_box = all_polygons_merged.envelope
-        aoi_gdf = gpd.GeoDataFrame.from_features(
-            [{"geometry": bounding_box, "properties": {"name": "lahaina_aoi"}}],
-            crs=gdf_bldg.crs,
-        )
-
-        aoi_boundary = aoi_gdf.unary_union
-        gdf_fully_inside = gdf_bldg[gdf_bldg.within(aoi_boundary)].copy()
+        gdf_bldg = prepare_footprints(gdf_bldg, src)
 
     dataset_dir = os.path.join(DATASETS_DIR, "lahaina_building_dataset")
     prepare_sar_dataset(
-        gdf_fully_inside,
+        gdf_bldg,
         lahaina_sar,
         dataset_dir,
         target_size=(224, 224),
         split_ratios=(0.7, 0.15, 0.15),
         random_state=42,
+        num_workers=PREPROCESS_WORKERS,
+        normalization=CHIP_NORMALIZATION,
+        output_format=CHIP_FORMAT,
+        writer_options={"write_threads": CHIP_WRITE_THREADS},
+        aoi_cache_bytes=AOI_CACHE_BYTES,
     )
     logger.info(f"Lahaina dataset prepared at: {dataset_dir}")
 
@@ -0,0 +1,214 @@
+import os
+import re
+import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from http_session import get_session, iter_body
+from journal import JsonlJournal, read_jsonl
+
+logger = logging.getLogger("range_download")
+
+# bytes a segment writes between journal records
+JOURNAL_INTERVAL = 16 * 1024 * 1024
+_MD5_ETAG = re.compile(r'^"?([0-9a-f]{32})"?$')
+
+
+class DownloadJournal(JsonlJournal):
+    """
+    Progress record for one ranged download. The first line describes the
+    object (url, size, ETag, segment size); each later line is the byte
+    count a segment has written, recorded after the data it covers so a
+    killed download resumes where it left off.
+    """
+
+    def __init__(self, path, header):
+        self.header = header
+        progress = self._load(path)
+        self.resumed = progress is not None
+        self.progress = progress or {}
+        super().__init__(path, "a" if self.resumed else "w")
+        if not self.resumed:
+            self.append(header)
+
+    def _load(self, path):
+        """
+        Segment progress recorded by an earlier run of the same object, or
+        None when there is no journal or it describes another object.
+        """
+        if not os.path.exists(path):
+            return None
+        records = read_jsonl(path)
+        if next(records, None) != self.header:
+            return None
+        return {entry["segment"]: entry["done"] for entry in records}
+
+    def record(self, segment, done):
+        self.append({"segment": segment, "done": done})
+
+
+def remote_object(url, timeout=30):
+    """
+    (size, etag, accepts_ranges) of url from a HEAD request; size is None
+    when the server does not report it.
+    """
+    r = get_session().head(url, allow_redirects=True, timeout=timeout)
+    r.raise_for_status()
+    size = r.headers.get("Content-Length")
+    accepts_ranges = r.headers.get("Accept-Ranges", "").lower() == "bytes"
+    return (int(size) if size is not None else None, r.headers.get("ETag"), accepts_ranges)
+
+
+def _fetch_segment(url, part_path, journal, index, start, end, etag,
+                   chunk_size, retries, timeout):
+    """
+    Writes bytes [start, end] of url into part_path at the same offset,
+    starting after what the journal already has and resuming from the
+    last written byte on connection errors.
+    """
+    done = journal.progress.get(index, 0)
+    recorded = done
+    attempt = 0
+    while start + done <= end:
+        headers = {"Range": f"bytes={start + done}-{end}"}
+        if etag:
+            # a changed object is sent whole (200) instead of the range
+            headers["If-Range"] = etag
+        try:
+            with get_session().get(
+                url, headers=headers, stream=True, timeout=timeout
+            ) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise IOError(
+                        f"Server answered a range request with {r.status_code}; "
+                        f"the object may have changed: {url}"
+                    )
+                with open(part_path, "r+b") as f:
+                    f.seek(start + done)
+                    for chunk in iter_body(r, chunk_size=chunk_size):
+                        f.write(chunk)
+                        done += len(chunk)
+                        if done - recorded >= JOURNAL_INTERVAL:
+                            f.flush()
+                            journal.record(index, done)
+                            recorded = done
+        except requests.RequestException as e:
+            attempt += 1
+            if attempt > retries:
+                raise
+            logger.warning(
+                f"Segment {index} of {url} failed at byte {start + done} "
+                f"({e}); retrying ({attempt}/{retries})"
+            )
+            time.sleep(min(2 ** attempt, 30))
+        finally:
+            if done != recorded:
+                journal.record(index, done)
+                recorded = done
+    if start + done != end + 1:
+        raise IOError(f"Segment {index} of {url} overran its range")
+    return done
+
+
+def file_md5(path, chunk_size=8 * 1024 * 1024):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def verify_download(path, size, etag=None):
+    """
+    Checks path's size and, when the ETag is a plain MD5 (S3 single-part
+    uploads), its checksum. Raises IOError on mismatch.
+    """
+    actual = os.path.getsize(path)
+    if actual != size:
+        raise IOError(f"Downloaded {actual} bytes, expected {size}: {path}")
+    match = _MD5_ETAG.match(etag or "")
+    if match and file_md5(path) != match.group(1):
+        raise IOError(f"MD5 does not match ETag {etag}: {path}")
+
+
+def download_ranged(url, local_path, size, etag=None, workers=8,
+                    segment_size=64 * 1024 * 1024, chunk_size=1024 * 1024,
+                    retries=3, timeout=60):
+    """
+    Downloads url (size bytes, server supports Range) with up to workers
+    concurrent range requests of segment_size bytes each.
+
+    Data goes to <local_path>.part with progress in <local_path>.part.jsonl;
+    an interrupted download resumes from the journal on the next call.
+    The part file is renamed to local_path only after the size (and MD5
+    ETag, when present) check passes.
+    """
+    part_path = f"{local_path}.part"
+    journal_path = f"{part_path}.jsonl"
+    if not os.path.exists(part_path) and os.path.exists(journal_path):
+        os.remove(journal_path)
+    header = {"url": url, "size": size, "etag": etag, "segment_size": segment_size}
+    journal = DownloadJournal(journal_path, header)
+    if journal.resumed:
+        done = sum(journal.progress.values())
+        logger.info(f"Resuming {url} at {done}/{size} bytes")
+    else:
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+
+    segments = [
+        (i, start, min(start + segment_size, size) - 1)
+        for i, start in enumerate(range(0, size, segment_size))
+    ]
+    start_time = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = [
+                pool.submit(
+                    _fetch_segment, url, part_path, journal, i, start, end,
+                    etag, chunk_size, retries, timeout,
+                )
+                for i, start, end in segments
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        journal.close()
+    elapsed = time.perf_counter() - start_time
+
+    try:
+        verify_download(part_path, size, etag)
+    except IOError:
+        # corrupt data: start over next time rather than resume into it
+        os.remove(part_path)
+        os.remove(journal.path)
+        raise
+    os.replace(part_path, local_path)
+    os.remove(journal.path)
+    logger.info(
+        f"Downloaded {size / 1e6:.1f} MB in {elapsed:.1f}s "
+        f"({size / 1e6 / max(elapsed, 1e-9):.1f} MB/s, {len(segments)} segments)"
+    )
+    return local_path
+
+
+def download_stream(url, local_path, chunk_size=1024 * 1024, timeout=60):
+    """
+    Single-connection download to <local_path>.part, renamed when complete
+    (for servers without Range support or objects of unknown size).
+    """
+    part_path = f"{local_path}.part"
+    with get_session().get(url, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        expected = r.headers.get("Content-Length")
+        with open(part_path, "wb") as f:
+            for chunk in iter_body(r, chunk_size=chunk_size):
+                f.write(chunk)
+    if expected is not None and "Content-Encoding" not in r.headers:
+        verify_download(part_path, int(expected), r.headers.get("ETag"))
+    os.replace(part_path, local_path)
+    return local_path
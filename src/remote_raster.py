@@ -0,0 +1,71 @@
+import os
+import hashlib
+import logging
+import urllib.parse
+
+from range_download import remote_object
+
+logger = logging.getLogger("remote_raster")
+
+REMOTE_PREFIX = "/vsicurl/"
+# sidecars (valid-data boundary, histogram) of rasters read over HTTP
+REMOTE_CACHE_DIR = os.environ.get("REMOTE_CACHE_DIR", "/data/processed/remote")
+
+# GDAL configuration for windowed reads of COGs over HTTP
+GDAL_REMOTE_OPTIONS = {
+    # no directory listing or .aux.xml/.ovr probes on open
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.tiff",
+    # header and tile index in one request instead of 16 KB steps
+    "GDAL_INGESTED_BYTES_AT_OPEN": str(256 * 1024),
+    # tiles of one read fetched as parallel ranges, adjacent ones merged
+    "GDAL_HTTP_MULTIRANGE": "YES",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "GDAL_HTTP_MULTIPLEX": "YES",
+    # downloaded ranges stay cached for neighbouring chips
+    "CPL_VSIL_CURL_CACHE_SIZE": str(256 * 1024 * 1024),
+    "GDAL_HTTP_MAX_RETRY": "4",
+    "GDAL_HTTP_RETRY_DELAY": "1",
+}
+
+
+def configure_remote_reads():
+    """
+    Puts GDAL_REMOTE_OPTIONS in os.environ, where GDAL reads config
+    options from, so every rasterio.open in this process and in the
+    extraction workers it starts uses them. Values already set win.
+    """
+    for key, value in GDAL_REMOTE_OPTIONS.items():
+        os.environ.setdefault(key, value)
+
+
+def remote_path(url):
+    return REMOTE_PREFIX + url
+
+
+def is_remote(path):
+    return str(path).startswith(REMOTE_PREFIX)
+
+
+def remote_url(path):
+    return path[len(REMOTE_PREFIX):]
+
+
+def remote_key(path):
+    """
+    Identity of a remote raster for cache keys: its ETag, or its size when
+    the server sends none.
+    """
+    size, etag, _ = remote_object(remote_url(path))
+    return f"etag:{etag}" if etag else f"size:{size}"
+
+
+def remote_sidecar_path(path, suffix):
+    """
+    Local path for a remote raster's sidecar file, named after its URL.
+    """
+    url = remote_url(path)
+    name = os.path.basename(urllib.parse.urlparse(url).path)
+    digest = hashlib.sha1(url.encode()).hexdigest()[:16]
+    os.makedirs(REMOTE_CACHE_DIR, exist_ok=True)
+    return os.path.join(REMOTE_CACHE_DIR, f"{digest}_{name}{suffix}")
@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import sqlite3
+import logging
+from datetime import datetime, timezone
+
+import shapely
+import rasterio
+import geopandas as gpd
+from affine import Affine
+from rasterio.coords import BoundingBox
+from rasterio.warp import transform_geom
+from shapely.geometry import mapping, shape
+
+from utils import (
+    RAW_DIR,
+    PROCESSED_DIR,
+    file_sha256,
+    load_or_build_valid_data_boundary,
+)
+from cog import COG_SUFFIX
+
+logger = logging.getLogger("scene_catalog")
+
+CATALOG_PATH = os.path.join(PROCESSED_DIR, "scenes.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    id INTEGER PRIMARY KEY,
+    scene_id TEXT UNIQUE NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL,
+    crs TEXT,
+    transform TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    dtype TEXT NOT NULL,
+    bounds TEXT NOT NULL,
+    footprint BLOB NOT NULL,
+    acquired TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS scenes_rtree USING rtree(
+    id, minx, maxx, miny, maxy
+);
+"""
+
+_CAPELLA_TIME = re.compile(r"_(\d{14})(?:_|\.|$)")
+
+
+def open_catalog(path=CATALOG_PATH):
+    """
+    Opens (creating if needed) the SQLite scene catalog. The R-tree holds
+    each scene's valid-data footprint bounds in EPSG:4326.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def scene_id_for(raster_path):
+    """
+    Catalog id of a raster: its file stem without the COG suffix, so a
+    scene and its COG share one entry.
+    """
+    name = os.path.basename(raster_path)
+    if name.endswith(COG_SUFFIX):
+        return name[: -len(COG_SUFFIX)]
+    return os.path.splitext(name)[0]
+
+
+def _acquisition_time(raster_path, src):
+    """
+    Capella start time from the product name, else the TIFF datetime tag.
+    """
+    match = _CAPELLA_TIME.search(os.path.basename(raster_path))
+    if match:
+        stamp = datetime.strptime(match.group(1), "%Y%m%d%H%M%S")
+        return stamp.replace(tzinfo=timezone.utc).isoformat()
+    tag = src.tags().get("TIFFTAG_DATETIME")
+    if tag:
+        stamp = datetime.strptime(tag, "%Y:%m:%d %H:%M:%S")
+        return stamp.replace(tzinfo=timezone.utc).isoformat()
+    return None
+
+
+def register_scene(raster_path, conn=None):
+    """
+    Adds or refreshes a raster's catalog entry: checksum, CRS, transform,
+    size, bounds, valid-data footprint (EPSG:4326) and acquisition time.
+
+    Unchanged files (same size and mtime) are skipped without opening
+    them. A COG replaces the original download's entry for its scene.
+    """
+    own_conn = conn is None
+    conn = conn or open_catalog()
+    try:
+        stat = os.stat(raster_path)
+        scene_id = scene_id_for(raster_path)
+        row = conn.execute(
+            "SELECT id, path, size, mtime FROM scenes WHERE scene_id = ?", (scene_id,)
+        ).fetchone()
+        if row is not None:
+            same_file = (
+                row["path"] == os.path.abspath(raster_path)
+                and row["size"] == stat.st_size
+                and row["mtime"] == stat.st_mtime
+            )
+            # keep the COG entry when the original is scanned after it
+            cog_registered = row["path"].endswith(COG_SUFFIX) and os.path.exists(
+                row["path"]
+            )
+            if same_file or (cog_registered and not raster_path.endswith(COG_SUFFIX)):
+                return scene_id
+
+        logger.info(f"Cataloguing scene {scene_id}: {raster_path}")
+        with rasterio.open(raster_path) as src:
+            crs = src.crs.to_wkt() if src.crs else None
+            transform = list(src.transform)[:6]
+            width, height, dtype = src.width, src.height, src.dtypes[0]
+            bounds = list(src.bounds)
+            acquired = _acquisition_time(raster_path, src)
+            src_crs = src.crs
+        boundary = load_or_build_valid_data_boundary(raster_path)
+        footprint = shape(transform_geom(src_crs, "EPSG:4326", mapping(boundary)))
+        minx, miny, maxx, maxy = footprint.bounds
+
+        values = (
+            scene_id,
+            os.path.abspath(raster_path),
+            stat.st_size,
+            stat.st_mtime,
+            file_sha256(raster_path),
+            crs,
+            json.dumps(transform),
+            width,
+            height,
+            dtype,
+            json.dumps(bounds),
+            shapely.to_wkb(footprint),
+            acquired,
+        )
+        with conn:
+            if row is not None:
+                conn.execute("DELETE FROM scenes_rtree WHERE id = ?", (row["id"],))
+                conn.execute("DELETE FROM scenes WHERE id = ?", (row["id"],))
+            cur = conn.execute(
+                "INSERT INTO scenes (scene_id, path, size, mtime, sha256, crs, "
+                "transform, width, height, dtype, bounds, footprint, acquired) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                values,
+            )
+            conn.execute(
+                "INSERT INTO scenes_rtree VALUES (?, ?, ?, ?, ?)",
+                (cur.lastrowid, minx, maxx, miny, maxy),
+            )
+        return scene_id
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def refresh_catalog(raw_dir=RAW_DIR, conn=None):
+    """
+    Registers every GeoTIFF in raw_dir (COGs first) and drops entries
+    whose file is gone.
+    """
+    own_conn = conn is None
+    conn = conn or open_catalog()
+    try:
+        names = sorted(
+            (f for f in os.listdir(raw_dir) if f.endswith(".tif")),
+            key=lambda f: not f.endswith(COG_SUFFIX),
+        )
+        for name in names:
+            try:
+                register_scene(os.path.join(raw_dir, name), conn)
+            except Exception as e:
+                logger.warning(f"Could not catalogue {name}: {e}")
+
+        stale = [
+            row["id"]
+            for row in conn.execute("SELECT id, path FROM scenes")
+            if not os.path.exists(row["path"])
+        ]
+        with conn:
+            for scene_pk in stale:
+                conn.execute("DELETE FROM scenes_rtree WHERE id = ?", (scene_pk,))
+                conn.execute("DELETE FROM scenes WHERE id = ?", (scene_pk,))
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def _record(row):
+    record = dict(row)
+    record["transform"] = Affine(*json.loads(record["transform"]))
+    record["bounds"] = BoundingBox(*json.loads(record["bounds"]))
+    record["footprint"] = shapely.from_wkb(record["footprint"])
+    return record
+
+
+def get_scene(scene_id, conn=None):
+    """
+    Catalog record (dict) of the scene with exactly this id, or None.
+    """
+    own_conn = conn is None
+    conn = conn or open_catalog()
+    try:
+        row = conn.execute(
+            "SELECT * FROM scenes WHERE scene_id = ?", (scene_id,)
+        ).fetchone()
+        return None if row is None else _record(row)
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def find_scenes_for_aoi(aoi, conn=None):
+    """
+    Catalog records of scenes whose valid-data footprint intersects aoi
+    (GeoSeries/GeoDataFrame), best first: largest share of the AOI
+    covered, then most recent acquisition. Only the catalog is read.
+    """
+    geom = gpd.GeoSeries(aoi.geometry).to_crs("EPSG:4326").union_all()
+    minx, miny, maxx, maxy = geom.bounds
+
+    own_conn = conn is None
+    conn = conn or open_catalog()
+    try:
+        rows = conn.execute(
+            "SELECT s.* FROM scenes s JOIN scenes_rtree r ON s.id = r.id "
+            "WHERE r.minx <= ? AND r.maxx >= ? AND r.miny <= ? AND r.maxy >= ?",
+            (maxx, minx, maxy, miny),
+        ).fetchall()
+    finally:
+        if own_conn:
+            conn.close()
+
+    scored = []
+    for row in rows:
+        record = _record(row)
+        covered = record["footprint"].intersection(geom)
+        if covered.is_empty:
+            continue
+        share = covered.area / geom.area if geom.area > 0 else 1.0
+        scored.append((share, record["acquired"] or "", record))
+    scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    return [record for _, _, record in scored]
+
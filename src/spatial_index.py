@@ -0,0 +1,76 @@
+import logging
+
+import numpy as np
+import shapely
+from shapely.geometry import box
+
+logger = logging.getLogger("spatial_index")
+
+
+def aoi_envelope(geometries):
+    """
+    Bounding box of all geometries, from their total bounds rather than the
+    envelope of a unary_union.
+    """
+    return box(*shapely.total_bounds(np.asarray(geometries)))
+
+
+def bbox_in_crs(geoseries, crs):
+    """
+    Bounds of a GeoSeries reprojected to crs. Edges are densified first so
+    lines that curve under the reprojection stay inside the box.
+    """
+    minx, miny, maxx, maxy = geoseries.total_bounds
+    extent = max(maxx - minx, maxy - miny)
+    if extent > 0:
+        geoseries = geoseries.segmentize(extent / 100)
+    return tuple(geoseries.to_crs(crs).total_bounds)
+
+
+class FootprintIndex:
+    """
+    STRtree over a footprint geometry array for containment queries.
+
+    Queries prefilter candidates by bounding box in the tree and run the
+    exact predicate only on those, so the cost follows the number of
+    footprints near the boundary rather than the size of the set.
+    """
+
+    def __init__(self, geometries):
+        self.geometries = np.asarray(geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    def within(self, boundary):
+        """
+        Sorted positions of the geometries that are within boundary (same
+        result as geometries.within(boundary)).
+        """
+        return np.sort(self.tree.query(boundary, predicate="contains"))
+
+    def intersecting(self, boundary):
+        """
+        Sorted positions of the geometries that intersect boundary.
+        """
+        return np.sort(self.tree.query(boundary, predicate="intersects"))
+
+
+def filter_within(gdf, boundary):
+    """
+    Rows of gdf whose geometry is within boundary, in their original order.
+
+    For a single query: a vectorized bounding-box test picks candidates and
+    only those run the exact predicate. An STRtree build costs more than
+    that, so use FootprintIndex when one set is queried repeatedly.
+    """
+    geometries = np.asarray(gdf.geometry.values)
+    bounds = shapely.bounds(geometries)
+    minx, miny, maxx, maxy = boundary.bounds
+    candidates = np.flatnonzero(
+        (bounds[:, 0] >= minx)
+        & (bounds[:, 1] >= miny)
+        & (bounds[:, 2] <= maxx)
+        & (bounds[:, 3] <= maxy)
+    )
+    keep = candidates[shapely.within(geometries[candidates], boundary)]
+    logger.info(f"{len(keep)} of {len(gdf)} footprints within boundary")
+    return gdf.iloc[keep]
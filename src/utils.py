@@ -1,21 +1,57 @@
 import os
+import json
 import shutil
 import uuid
+import hashlib
 import logging
 import zipfile
+import threading
 import urllib.parse
 
 import numpy as np
 import pandas as pd
 import requests
+import shapely
 import geopandas as gpd
 import rasterio
-from rasterio.mask import mask
+from affine import Affine
 from rasterio.errors import RasterioIOError
 from rasterio.features import shapes
 from shapely.geometry import box, shape
 from shapely.ops import unary_union
 
+from chip_extraction import (
+    iter_chips,
+    is_rectilinear,
+    spatial_order,
+    block_cache_hit_rate,
+    union_window,
+    create_shared_region,
+    attach_shared_region,
+)
+from normalization import (
+    ScratchBuffers,
+    stretch_and_pad,
+    stretch_lut,
+    scene_stretch_bounds,
+)
+from footprint_table import FootprintTable, SPLIT_NAMES
+from spatial_index import filter_within, bbox_in_crs
+from chip_store import (
+    open_chip_writer,
+    create_chip_array,
+    finalize_chip_store,
+    chip_keys,
+    ManifestJournal,
+    load_manifest,
+    is_valid_chip,
+    compact_manifest,
+    is_manifest_file,
+)
+from range_download import remote_object, download_ranged, download_stream
+from http_session import transfer_stats
+from remote_raster import is_remote, remote_key, remote_sidecar_path
+
 # create paths/directories
 DATA_ROOT = "/data"
 RAW_DIR = os.path.join(DATA_ROOT, "raw")
@@ -24,6 +60,22 @@ DATASETS_DIR = os.path.join(DATA_ROOT, "datasets")
 MODELS_DIR = os.path.join(DATA_ROOT, "models")
 RESULTS_DIR = os.path.join(DATA_ROOT, "results")
 
+# chip extraction processes; the preprocess job requests 2 CPUs
+PREPROCESS_WORKERS = int(os.environ.get("PREPROCESS_WORKERS", "1"))
+# "chip" (per-chip percentile stretch) or "scene" (scene histogram bounds)
+CHIP_NORMALIZATION = os.environ.get("CHIP_NORMALIZATION", "chip")
+# "png" (YOLO folders) or "array" (memory-mapped chip store per split)
+CHIP_FORMAT = os.environ.get("CHIP_FORMAT", "png")
+# background chip writer threads (0 = write inline)
+CHIP_WRITE_THREADS = int(os.environ.get("CHIP_WRITE_THREADS", "0"))
+# shared-memory AOI cache budget for parallel extraction (0 = off)
+AOI_CACHE_BYTES = int(os.environ.get("AOI_CACHE_MB", "0")) * 1024 * 1024
+# concurrent HTTP range requests per download, and bytes per range
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "8"))
+DOWNLOAD_SEGMENT_BYTES = int(os.environ.get("DOWNLOAD_SEGMENT_MB", "64")) * 1024 * 1024
+# read SAR scenes over HTTP (/vsicurl/) instead of downloading them
+REMOTE_READS = os.environ.get("REMOTE_READS", "0") == "1"
+
 os.makedirs(RAW_DIR, exist_ok=True)
 os.makedirs(PROCESSED_DIR, exist_ok=True)
 os.makedirs(DATASETS_DIR, exist_ok=True)
@@ -38,22 +90,64 @@ logger = logging.getLogger("sar_utils")
 
 
 # create functions
+_download_locks = {}
+_download_locks_guard = threading.Lock()
+
+
+def _download_lock(local_path):
+    key = os.path.abspath(local_path)
+    with _download_locks_guard:
+        return _download_locks.setdefault(key, threading.Lock())
+
+
 def download_file(url: str, local_path: str, overwrite: bool = False) -> str:
     """
-    Downloads a file from URL to local_path if it doesn't exist or overwrite=True.
+    Downloads a file from URL to local_path unless a complete copy exists
+    or overwrite=True.
+
+    Servers that accept Range requests are read in DOWNLOAD_WORKERS
+    concurrent segments that resume after an interruption; others over a
+    single stream. The file only appears at local_path after its size (and
+    MD5 ETag, when the server gives one) has been checked. Concurrent calls
+    for one local_path download it once; the rest reuse that file.
     """
+    with _download_lock(local_path):
+        return _download_file(url, local_path, overwrite)
+
+
+def _download_file(url, local_path, overwrite):
+    try:
+        size, etag, accepts_ranges = remote_object(url)
+    except requests.RequestException as e:
+        if os.path.exists(local_path) and not overwrite:
+            logger.warning(f"Could not check {url} ({e}); keeping {local_path}")
+            transfer_stats.add_reused(os.path.getsize(local_path))
+            return local_path
+        size, etag, accepts_ranges = None, None, False
+
     if os.path.exists(local_path) and not overwrite:
-        logger.info(f"File already exists, skipping download: {local_path}")
-        return local_path
+        if size is None or os.path.getsize(local_path) == size:
+            logger.info(f"File already exists, skipping download: {local_path}")
+            transfer_stats.add_reused(os.path.getsize(local_path))
+            return local_path
+        logger.warning(
+            f"{local_path} has {os.path.getsize(local_path)} of {size} bytes; "
+            f"downloading again"
+        )
 
     os.makedirs(os.path.dirname(local_path), exist_ok=True)
     logger.info(f"Downloading {url} -> {local_path}")
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(local_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+    if accepts_ranges and size:
+        download_ranged(
+            url,
+            local_path,
+            size,
+            etag=etag,
+            workers=DOWNLOAD_WORKERS,
+            segment_size=DOWNLOAD_SEGMENT_BYTES,
+        )
+    else:
+        download_stream(url, local_path)
     logger.info(f"Saved: {local_path}")
     return local_path
 
@@ -83,49 +177,324 @@ def unzip_file(zip_path: str, extract_to_path: str) -> None:
     logger.info("Unzip complete.")
 
 
-def _process_and_save(df, split_name, raster_src, output_dir, target_size):
+def file_sha256(path, chunk_size=8 * 1024 * 1024):
+    """
+    SHA-256 of a file, cached in a <path>.sha256 sidecar keyed by size and
+    mtime so multi-GB rasters are hashed once.
+    """
+    stat = os.stat(path)
+    sidecar = f"{path}.sha256"
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            cached = json.load(f)
+        if cached.get("size") == stat.st_size and cached.get("mtime") == stat.st_mtime:
+            return cached["sha256"]
+
+    logger.info(f"Computing checksum: {path}")
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with open(sidecar, "w") as f:
+        json.dump({"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest}, f)
+    return digest
+
+
+def raster_checksum(path):
     """
-    Internal helper to extract SAR chips for a split and save PNGs.
+    sha256 of a local raster, or the ETag-based key of a /vsicurl/ one.
     """
-    from PIL import Image
+    return remote_key(path) if is_remote(path) else file_sha256(path)
 
-    for idx, row in df.iterrows():
-        geom = [row.geometry]
-        label = row["label"]
-        image_name = f"building_{idx}.png"
 
-        try:
-            out_image, _ = mask(raster_src, geom, crop=True, nodata=0)
-            out_image = out_image[0]  # first band
+def footprint_ids(geometries, length=16):
+    """
+    Deterministic ids from each footprint's WKB hash, so reruns name the
+    same building's chip identically. Duplicate geometries get a -<n>
+    suffix in input order.
+    """
+    ids = []
+    seen = {}
+    for wkb in shapely.to_wkb(np.asarray(geometries)):
+        digest = hashlib.sha1(wkb if wkb is not None else b"").hexdigest()[:length]
+        n = seen.get(digest, 0)
+        seen[digest] = n + 1
+        ids.append(digest if n == 0 else f"{digest}-{n}")
+    return ids
 
-            if out_image.size == 0:
-                continue
 
-            valid_pixels = out_image[out_image != 0]
-            if valid_pixels.size > 0:
-                vmin, vmax = np.percentile(valid_pixels, (2, 98))
-                if vmax > vmin:
-                    out_image = np.clip(out_image, vmin, vmax)
-                    out_image = ((out_image - vmin) / (vmax - vmin) * 255).astype(
-                        np.uint8
-                    )
-                else:
-                    out_image = np.full(out_image.shape, 128, dtype=np.uint8)
-            else:
-                out_image = np.zeros(out_image.shape, dtype=np.uint8)
+def prepare_footprints(gdf, src, buffer_distance=5.0, simplify_pixels=0.25, explode=False):
+    """
+    Geometry preparation for chip extraction in one vectorized stage:
+    optional explode of multi-part footprints, deterministic ids from the
+    source geometry, then reprojection straight to the raster CRS, buffer
+    by buffer_distance metres, simplification to simplify_pixels of the
+    raster pixel size and a bulk make_valid.
+
+    gdf needs a 'label' column. Returns a frame indexed by "id" with
+    'geometry' (raster CRS) and 'label'.
+    """
+    if explode:
+        gdf = gdf.explode(index_parts=False)
+    ids = footprint_ids(gdf.geometry)
+
+    crs = src.crs
+    if crs.is_geographic:
+        # no metric buffer in degrees; buffer in the local UTM zone instead
+        utm = gdf.geometry.to_crs(gdf.geometry.estimate_utm_crs())
+        geoms = np.asarray(utm.buffer(buffer_distance, 16).to_crs(crs).values)
+    else:
+        geoms = np.asarray(gdf.geometry.to_crs(crs).values)
+        _, metres_per_unit = crs.linear_units_factor
+        geoms = shapely.buffer(geoms, buffer_distance / metres_per_unit, quad_segs=16)
+    if simplify_pixels:
+        tolerance = simplify_pixels * min(abs(src.res[0]), abs(src.res[1]))
+        # plain Douglas-Peucker; make_valid repairs any self-intersections
+        geoms = shapely.simplify(geoms, tolerance, preserve_topology=False)
+    geoms = shapely.make_valid(geoms)
+
+    prepared = gpd.GeoDataFrame(
+        {"label": gdf["label"].to_numpy()},
+        geometry=geoms,
+        crs=crs,
+        index=pd.Index(ids, name="id"),
+    )
+    return prepared[["geometry", "label"]]
 
-            h, w = out_image.shape
-            canvas = np.zeros(target_size, dtype=np.uint8)
-            y_off = (target_size[0] - h) // 2
-            x_off = (target_size[1] - w) // 2
-            canvas[y_off : y_off + h, x_off : x_off + w] = out_image
 
-            out_dir = os.path.join(output_dir, split_name, str(label))
-            os.makedirs(out_dir, exist_ok=True)
-            output_path = os.path.join(out_dir, image_name)
-            Image.fromarray(canvas).save(output_path)
-        except Exception as e:
-            logger.warning(f"Error processing building {idx}: {e}")
+def _process_and_save(
+    table,
+    split_name,
+    raster_src,
+    output_dir,
+    target_size,
+    stretch_bounds=None,
+    output_format="png",
+    row_offset=0,
+    writer_options=None,
+    batch_size=256,
+    journal=None,
+    resize_oversized=True,
+    source=None,
+):
+    """
+    Internal helper to extract SAR chips for a split (a FootprintTable)
+    and save them.
+
+    stretch_bounds: scene-level (vmin, vmax); None stretches each chip
+    by its own 2-98 percentiles.
+    output_format: "png"/"npy"/"zstd" files or "array" rows of the split's
+    chip store; row_offset is the table's first row within the split.
+    writer_options: keyword arguments for chip_store.open_chip_writer
+    (compress_level, write_threads, queue_size).
+    journal: ManifestJournal recording the table's chip key per written chip.
+    resize_oversized: read footprints larger than target_size decimated to
+    fit instead of dropping them.
+    source: ArrayWindowSource of decoded raster to slice chips from.
+    Returns the split rows that were written.
+    """
+    canvases = np.zeros((batch_size,) + tuple(target_size), dtype=np.uint8)
+    scratch = ScratchBuffers()
+    lut = None
+    if stretch_bounds is not None:
+        lut = stretch_lut(raster_src.dtypes[0], *stretch_bounds)
+    writer = open_chip_writer(
+        output_format, output_dir, split_name, journal=journal, **(writer_options or {})
+    )
+    keys = table.keys
+
+    def flush(batch):
+        stretch_and_pad(
+            [chip for _, _, _, chip in batch],
+            target_size,
+            out=canvases,
+            scratch=scratch,
+            bounds=stretch_bounds,
+            lut=lut,
+        )
+        for canvas, (row, idx, label, _) in zip(canvases, batch):
+            try:
+                key = None if keys is None else keys[row - row_offset]
+                writer.write(row, idx, label, canvas, key)
+            except Exception as e:
+                logger.warning(f"Error processing building {idx}: {e}")
+
+    batch = []
+    max_shape = tuple(target_size) if resize_oversized else None
+    chips = iter_chips(table, raster_src, max_shape, source=source)
+    for pos, idx, label, out_image in chips:
+        if out_image.size == 0:
+            continue
+        h, w = out_image.shape
+        if h > target_size[0] or w > target_size[1]:
+            logger.warning(
+                f"Error processing building {idx}: chip {h}x{w} exceeds "
+                f"target size {target_size[0]}x{target_size[1]}"
+            )
+            continue
+
+        batch.append((row_offset + pos, idx, label, out_image))
+        if len(batch) == batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    writer.close()
+    return writer.written
+
+
+def _process_and_save_shard(
+    raster_file_path,
+    table,
+    split_name,
+    output_dir,
+    target_size,
+    stretch_bounds,
+    output_format,
+    row_offset,
+    writer_options,
+    region_spec=None,
+):
+    """
+    Process-pool entry point: opens a private raster handle and extracts
+    one shard of a split, slicing chips from the shared AOI region when
+    region_spec is given.
+    """
+    journal = ManifestJournal(output_dir) if table.keys is not None else None
+    shm, source = (None, None)
+    if region_spec is not None:
+        shm, source = attach_shared_region(region_spec)
+    with rasterio.open(raster_file_path) as src:
+        written = _process_and_save(
+            table,
+            split_name,
+            src,
+            output_dir,
+            target_size,
+            stretch_bounds,
+            output_format,
+            row_offset,
+            writer_options,
+            journal=journal,
+            source=source,
+        )
+    if journal is not None:
+        journal.close()
+    if shm is not None:
+        del source
+        shm.close()
+    return split_name, len(table), written
+
+
+def _process_splits_parallel(
+    splits,
+    raster_file_path,
+    output_dir,
+    target_size,
+    num_workers,
+    stretch_bounds,
+    output_format,
+    writer_options,
+    aoi_cache_bytes=0,
+):
+    """
+    Shards every split's FootprintTable across a ProcessPoolExecutor.
+
+    Each chip is still written by the same per-footprint code as the
+    serial path, so the output files are identical. Returns the written
+    rows per split.
+
+    aoi_cache_bytes: when the window covering all footprints fits in this
+    many bytes, it is decoded once into shared memory and workers slice
+    chips from it; otherwise workers fall back to windowed reads.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    total = sum(len(table) for _, table in splits)
+    # a few shards per worker keeps the pool busy when shards finish unevenly
+    shard_size = max(1, -(-total // (num_workers * 4)))
+
+    shm, region_spec = None, None
+    written = {split_name: [] for split_name, _ in splits}
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        if aoi_cache_bytes > 0 and total > 0:
+            shm, region_spec = _share_aoi_region(
+                splits, raster_file_path, aoi_cache_bytes
+            )
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx) as pool:
+            futures = [
+                pool.submit(
+                    _process_and_save_shard,
+                    raster_file_path,
+                    table.take(slice(start, start + shard_size)),
+                    split_name,
+                    output_dir,
+                    target_size,
+                    stretch_bounds,
+                    output_format,
+                    start,
+                    writer_options,
+                    region_spec,
+                )
+                for split_name, table in splits
+                for start in range(0, len(table), shard_size)
+            ]
+            done = 0
+            for future in as_completed(futures):
+                split_name, count, rows = future.result()
+                written[split_name].extend(rows)
+                done += count
+                logger.info(f"Processed {done}/{total} footprints")
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+    return written
+
+
+def _share_aoi_region(splits, raster_file_path, aoi_cache_bytes):
+    """
+    Decodes the window covering every footprint into shared memory if it
+    fits the byte budget. Returns (shm, spec) or (None, None).
+    """
+    with rasterio.open(raster_file_path) as src:
+        if not is_rectilinear(src.transform):
+            return None, None
+        windows = np.concatenate([table.windows for _, table in splits])
+        region = union_window(windows)
+        if region is None:
+            return None, None
+        nbytes = region[2] * region[3] * np.dtype(src.dtypes[0]).itemsize
+        if nbytes > aoi_cache_bytes:
+            logger.info(
+                f"AOI window {region[2]}x{region[3]} needs {nbytes} bytes, over the "
+                f"{aoi_cache_bytes} byte cache budget; using windowed reads"
+            )
+            return None, None
+        logger.info(
+            f"Decoding AOI window {region[2]}x{region[3]} ({nbytes} bytes) "
+            "into shared memory"
+        )
+        return create_shared_region(src, region)
+
+
+def _order_for_block_cache(table, split_name, raster_src):
+    """
+    Reorders a split along a Hilbert curve over the raster blocks and logs
+    the modelled GDAL block-cache hit rate before and after.
+    """
+    windows = table.windows
+    order = spatial_order(windows, raster_src)
+    before = block_cache_hit_rate(windows, raster_src)
+    after = block_cache_hit_rate(windows[order], raster_src)
+    logger.info(
+        f"{split_name}: block-cache hit rate {before:.1%} as split, "
+        f"{after:.1%} in spatial order"
+    )
+    return table.take(order)
 
 
 def _safe_stratified_split(gdf, test_size, random_state):
@@ -168,12 +537,36 @@ def prepare_sar_dataset(
     target_size=(256, 256),
     split_ratios=(0.7, 0.15, 0.15),
     random_state=42,
+    num_workers=1,
+    order_footprints=True,
+    normalization="chip",
+    output_format="png",
+    writer_options=None,
+    resume=True,
+    aoi_cache_bytes=0,
 ):
     """
     Prepares a SAR image dataset by extracting chips and splitting into
     train/val/test, saving PNGs in YOLO classification folder structure.
 
     gdf: GeoDataFrame with 'geometry' and 'label'
+    num_workers: number of processes for chip extraction (1 = serial)
+    order_footprints: visit footprints in raster block order (split
+        membership is unchanged)
+    normalization: "chip" for a per-chip 2-98 percentile stretch, "scene"
+        for fixed bounds from the raster's cached scene histogram
+    output_format: "png" for the YOLO folder layout, "array" for a
+        memory-mapped (N, H, W) chip store plus index per split (see
+        chip_store.export_png_layout); "npy" and "zstd" write one raw or
+        zstd-compressed array file per chip in the same folders
+    writer_options: chip writer settings (compress_level, write_threads,
+        queue_size); write_threads > 0 writes from a background thread pool
+    resume: for file outputs, skip chips whose manifest entry (keyed by
+        raster checksum, footprint geometry and extraction parameters)
+        still matches a file on disk, and drop chips no longer produced
+    aoi_cache_bytes: with num_workers > 1, memory budget for decoding the
+        AOI once into shared memory (0 disables; larger AOIs fall back to
+        windowed reads)
     """
     logger.info(f"Preparing SAR dataset -> {output_dir}")
     os.makedirs(output_dir, exist_ok=True)
@@ -187,7 +580,7 @@ def prepare_sar_dataset(
                 gdf = gdf.to_crs(src.crs)
 
             initial_count = len(gdf)
-            gdf = gdf[gdf.geometry.within(raster_bounds_poly)].copy()
+            gdf = filter_within(gdf, raster_bounds_poly).copy()
             filtered_count = len(gdf)
             if filtered_count < initial_count:
                 logger.info(
@@ -230,12 +623,118 @@ def prepare_sar_dataset(
                 f"val: {len(val_gdf)}, test: {len(test_gdf)}"
             )
 
-            if not train_gdf.empty:
-                _process_and_save(train_gdf, "train", src, output_dir, target_size)
-            if not val_gdf.empty:
-                _process_and_save(val_gdf, "val", src, output_dir, target_size)
-            if not test_gdf.empty:
-                _process_and_save(test_gdf, "test", src, output_dir, target_size)
+            # convert once; everything downstream works on the columnar table
+            split_gdfs = (train_gdf, val_gdf, test_gdf)
+            table = FootprintTable.from_geodataframe(
+                pd.concat(split_gdfs),
+                src,
+                split=np.repeat(
+                    np.arange(len(SPLIT_NAMES)), [len(g) for g in split_gdfs]
+                ),
+            )
+            del gdf, train_val_gdf, train_gdf, val_gdf, test_gdf, split_gdfs
+            splits = table.split_tables()
+            if order_footprints and table.windows is not None:
+                splits = [
+                    (split_name, _order_for_block_cache(split_table, split_name, src))
+                    for split_name, split_table in splits
+                ]
+
+            if normalization == "scene":
+                aoi_region = None
+                if table.windows is not None:
+                    aoi_region = union_window(table.windows)
+                # remote rasters are histogrammed over the AOI window only
+                stretch_bounds = scene_stretch_bounds(
+                    raster_file_path, aoi_region=aoi_region
+                )
+            elif normalization == "chip":
+                stretch_bounds = None
+            else:
+                raise ValueError(f"Unknown normalization: {normalization}")
+
+            journal = None
+            resume_files = resume and output_format != "array"
+            if resume_files:
+                params = {
+                    "target_size": list(target_size),
+                    "stretch_bounds": stretch_bounds,
+                    "output_format": output_format,
+                    "compress_level": (writer_options or {}).get("compress_level"),
+                }
+                checksum = raster_checksum(raster_file_path)
+                manifest = load_manifest(output_dir)
+                current_keys = {}
+                pending = []
+                for split_name, split_table in splits:
+                    split_table.keys = np.asarray(
+                        chip_keys(split_table, split_name, checksum, params)
+                    )
+                    current_keys.update(zip(split_table.ids, split_table.keys))
+                    valid = np.array(
+                        [
+                            is_valid_chip(output_dir, manifest.get(cid), key)
+                            for cid, key in zip(split_table.ids, split_table.keys)
+                        ],
+                        dtype=bool,
+                    )
+                    if valid.any():
+                        logger.info(
+                            f"{split_name}: {int(valid.sum())} chips up to date, "
+                            f"{int((~valid).sum())} to extract"
+                        )
+                    if not valid.all():
+                        pending.append((split_name, split_table.take(~valid)))
+                splits = pending
+                journal = ManifestJournal(output_dir)
+
+            if output_format == "array":
+                for split_name, split_table in splits:
+                    create_chip_array(
+                        output_dir, split_name, len(split_table), target_size
+                    )
+
+            if num_workers > 1:
+                written = _process_splits_parallel(
+                    splits,
+                    raster_file_path,
+                    output_dir,
+                    target_size,
+                    num_workers,
+                    stretch_bounds,
+                    output_format,
+                    writer_options,
+                    aoi_cache_bytes,
+                )
+            else:
+                written = {
+                    split_name: _process_and_save(
+                        split_table,
+                        split_name,
+                        src,
+                        output_dir,
+                        target_size,
+                        stretch_bounds,
+                        output_format,
+                        writer_options=writer_options,
+                        journal=journal,
+                    )
+                    for split_name, split_table in splits
+                }
+
+            if resume_files:
+                journal.close()
+                compact_manifest(output_dir, current_keys)
+
+            if output_format == "array":
+                for split_name, split_table in splits:
+                    finalize_chip_store(
+                        output_dir,
+                        split_name,
+                        split_table,
+                        written[split_name],
+                        os.path.basename(raster_file_path),
+                    )
 
     except RasterioIOError:
         logger.error(f"Could not open raster file: {raster_file_path}")
@@ -253,6 +752,9 @@ def _copy_contents(source_dir, dest_dir):
         os.makedirs(dest_path_dir, exist_ok=True)
 
         for filename in files:
+            if is_manifest_file(filename):
+                # resume bookkeeping of the source dataset, not chips
+                continue
             src_fp = os.path.join(root, filename)
             dst_fp = os.path.join(dest_path_dir, filename)
             if os.path.exists(dst_fp):
@@ -280,35 +782,132 @@ def merge_and_copy_directories(dir1, dir2, new_dir):
     logger.info("Merge complete.")
 
 
-def query_gdb_contained_by_polygon(gdb_path, layer_name, polygon_gdf):
+def vector_layer_crs(path, layer_name):
+    try:
+        import pyogrio
+    except ImportError:
+        import fiona
+
+        with fiona.open(path, layer=layer_name) as layer:
+            return layer.crs
+    return pyogrio.read_info(path, layer=layer_name)["crs"]
+
+
+def vector_read_options(use_arrow=True):
+    """
+    gpd.read_file engine options: pyogrio (with Arrow batches when pyarrow
+    is installed and use_arrow is set) or fiona.
+    """
+    try:
+        import pyogrio  # noqa: F401
+    except ImportError:
+        return {"engine": "fiona"}
+    options = {"engine": "pyogrio"}
+    if use_arrow:
+        try:
+            import pyarrow  # noqa: F401
+
+            options["use_arrow"] = True
+        except ImportError:
+            pass
+    return options
+
+
+def query_gdb_contained_by_polygon(gdb_path, layer_name, polygon_gdf, use_arrow=True):
     """
     Queries a FileGDB layer and returns rows fully contained
     in polygon_gdf (single polygon).
+
+    The polygon's bounding box, in the layer's own CRS, is pushed down to
+    the reader so only features near the AOI are decoded.
     """
-    gdf = gpd.read_file(gdb_path, layer=layer_name)
     if len(polygon_gdf) != 1:
         raise ValueError("polygon_gdf must contain exactly one polygon.")
 
     poly = polygon_gdf.geometry.iloc[0]
 
+    bbox = bbox_in_crs(polygon_gdf.geometry, vector_layer_crs(gdb_path, layer_name))
+
+    gdf = gpd.read_file(
+        gdb_path, layer=layer_name, bbox=bbox, **vector_read_options(use_arrow)
+    )
+    logger.info(f"Read {len(gdf)} features of {layer_name} in AOI bbox {bbox}")
+
     if gdf.crs != polygon_gdf.crs:
         gdf = gdf.to_crs(polygon_gdf.crs)
 
-    contained = gdf[gdf.geometry.within(poly)]
+    contained = filter_within(gdf, poly)
     return contained
 
 
-def build_valid_data_boundary(src):
+def build_valid_data_boundary(src, decimation=1, inward_buffer=None):
     """
     Builds a polygon representing valid raster data
     from the nodata mask.
+
+    decimation > 1 polygonizes a mask read at 1/decimation resolution
+    (served from overviews when the raster has them) and shrinks the
+    result by inward_buffer map units; the default of one decimated
+    pixel diagonal keeps the boundary inside the full-resolution one.
     """
-    mask_arr = src.read_masks(1)
-    valid_geoms = list(
-        shapes(mask_arr, mask=(mask_arr == 255), transform=src.transform)
-    )
+    if decimation > 1:
+        out_shape = (
+            max(src.height // decimation, 1),
+            max(src.width // decimation, 1),
+        )
+        mask_arr = src.read_masks(1, out_shape=out_shape)
+        transform = src.transform * Affine.scale(
+            src.width / out_shape[1], src.height / out_shape[0]
+        )
+        if inward_buffer is None:
+            inward_buffer = float(np.hypot(transform.a, transform.e))
+    else:
+        mask_arr = src.read_masks(1)
+        transform = src.transform
+
+    valid_geoms = list(shapes(mask_arr, mask=(mask_arr == 255), transform=transform))
     if not valid_geoms:
         raise ValueError("No valid data found in raster.")
 
     valid_polys = [shape(geom) for geom, val in valid_geoms]
-    return unary_union(valid_polys)
+    boundary = unary_union(valid_polys)
+    if inward_buffer:
+        boundary = boundary.buffer(-inward_buffer)
+    return boundary
+
+
+def load_or_build_valid_data_boundary(raster_path, decimation=8, inward_buffer=None):
+    """
+    Returns the raster's valid-data boundary, reusing the GeoParquet file
+    next to the raster (in REMOTE_CACHE_DIR for /vsicurl/ rasters) when it
+    was built from the same raster checksum, decimation and inward buffer.
+    """
+    key = {
+        "raster_sha256": raster_checksum(raster_path),
+        "decimation": decimation,
+        "inward_buffer": -1.0 if inward_buffer is None else float(inward_buffer),
+    }
+    if is_remote(raster_path):
+        cache_path = remote_sidecar_path(raster_path, ".valid.parquet")
+    else:
+        cache_path = f"{raster_path}.valid.parquet"
+
+    if os.path.exists(cache_path):
+        cached = gpd.read_parquet(cache_path)
+        # a cache written before a key column existed is stale
+        if len(cached) and all(
+            k in cached.columns and cached[k].iloc[0] == v for k, v in key.items()
+        ):
+            logger.info(f"Using cached valid-data boundary: {cache_path}")
+            return cached.geometry.iloc[0]
+
+    logger.info(f"Building valid-data boundary for {raster_path}")
+    with rasterio.open(raster_path) as src:
+        boundary = build_valid_data_boundary(src, decimation, inward_buffer)
+        crs = src.crs
+
+    gpd.GeoDataFrame(
+        {k: [v] for k, v in key.items()}, geometry=[boundary], crs=crs
+    ).to_parquet(cache_path)
+    logger.info(f"Saved valid-data boundary: {cache_path}")
+    return boundary